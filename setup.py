@@ -15,7 +15,7 @@ setup(
     include_package_data=True,
     package_dir={'': 'src'},
     packages=find_packages('src'),
-    py_modules=['common', 'data_source'],
+    py_modules=['common', 'data_source', 'manifest'],
     install_requires=[
         'neo4j==1.7.3',
         'neobolt==1.7.13',
@@ -1,11 +1,20 @@
 import logging
 import os
 import time
+from functools import partial
 import click
 import coloredlogs
 from common import ContextInfo
+from common import ReferenceData
 from common import get_neo_uri
+from common import get_taxonomy_subtype_map
+from common import run_tasks
 from data_source import DataSource
+from data_source import QueryCache
+from data_source import TeeDataSource
+from manifest import Manifest
+from upload import UploadManager
+from validators import RecordValidator
 from generators import (disease_file_generator,
                         db_summary_file_generator,
                         expression_file_generator,
@@ -43,8 +52,6 @@ if config_info.config["DEBUG"]:
 
 ignore_assemblies = ["", "GRCh38", "R64-2-1", "ASM985889v3"]
 
-taxon_id_fms_subtype_map = DataSource.get_taxonomy_subtype_map()
-
 
 @click.command()
 @click.option('--variant-allele', is_flag=True, help='Generates Variant Allele files')
@@ -60,6 +67,9 @@ taxon_id_fms_subtype_map = DataSource.get_taxonomy_subtype_map()
 @click.option('--allele-gff', is_flag=True, help='Generates an Allele based GFF file')
 @click.option('--upload', is_flag=True, help='Submits generated files to File Management System (FMS)')
 @click.option('--validate', is_flag=True, help='Validate generated file. If uploading then validates automatically')
+@click.option('--jobs', type=int, default=None, help='Number of file types generated concurrently. Defaults to "threads" in config.yaml')
+@click.option('--clear-query-cache', is_flag=True, help='Empties QUERY_CACHE_DIR before generating files')
+@click.option('--incremental', is_flag=True, help='Skips uploading variant allele, disease and expression files unchanged since their last upload')
 def main(variant_allele,
          vcf,
          orthology,
@@ -73,6 +83,9 @@ def main(variant_allele,
          uniprot,
          human_genes_interacting_with,
          allele_gff,
+         jobs,
+         clear_query_cache,
+         incremental,
          generated_files_folder=generated_files_folder,
          skip_chromosomes={'Unmapped_Scaffold_8_D1580_D1567'}):
 
@@ -86,41 +99,79 @@ def main(variant_allele,
         os.makedirs(generated_files_folder, exist_ok=True)
 
     click.echo('INFO:\tFiles output: ' + generated_files_folder)
+    DataSource.max_connection_pool_size = int(config_info.config['NEO4J_MAX_POOL_SIZE'])
+    DataSource.fetch_size = int(config_info.config['NEO4J_FETCH_SIZE'])
+    ReferenceData.snapshot_path = config_info.config['REFERENCE_DATA_SNAPSHOT']
+    ReferenceData.release = config_info.config['RELEASE_VERSION']
+    ReferenceData.species_yaml_path = config_info.config['SPECIES_YAML']
+    ReferenceData.cache_dir = os.path.join(generated_files_folder, 'reference_data')
+    if config_info.config['QUERY_CACHE_DIR']:
+        DataSource.cache = QueryCache(config_info.config['QUERY_CACHE_DIR'],
+                                      config_info.config['RELEASE_VERSION'],
+                                      int(config_info.config['QUERY_CACHE_MAX_SIZE_MB']) * 1024 * 1024)
+        if clear_query_cache:
+            DataSource.cache.clear()
+    RecordValidator.deep = str(config_info.config['DEEP_JSON_VALIDATION']).lower() == 'true'
+    if incremental:
+        Manifest.path = os.path.join(generated_files_folder, 'manifest.json')
+        Manifest.release = config_info.config['RELEASE_VERSION']
+    if jobs is None:
+        jobs = int(config_info.config['threads'])
+
+    tasks = []
     if variant_allele is True or all_filetypes is True:
         click.echo('INFO:\tGenerating Variant Allele JSON and TSV files')
-        generate_variant_allele_files(generated_files_folder, skip_chromosomes, config_info, upload, validate)
+        tasks.append(('Variant Allele', partial(generate_variant_allele_files, generated_files_folder, skip_chromosomes, config_info, upload, validate)))
     if vcf is True or all_filetypes is True:
         click.echo('INFO:\tGenerating VCF files, VCF gz files and VCF gz Tabix files')
-        generate_vcf_files(generated_files_folder, skip_chromosomes, config_info, upload, validate)
+        tasks.append(('VCF', partial(generate_vcf_files, generated_files_folder, skip_chromosomes, config_info, upload, validate)))
     if orthology is True or all_filetypes is True:
         click.echo('INFO:\tGenerating Orthology file')
-        generate_orthology_file(generated_files_folder, config_info, upload, validate)
+        tasks.append(('Orthology', partial(generate_orthology_file, generated_files_folder, config_info, upload, validate)))
     if disease is True or all_filetypes is True:
         click.echo('INFO:\tGenerating Disease files')
-        generate_disease_file(generated_files_folder, config_info, taxon_id_fms_subtype_map, upload, validate)
+        tasks.append(('Disease', partial(generate_disease_file, generated_files_folder, config_info, upload, validate)))
     if expression is True or all_filetypes is True:
         click.echo('INFO:\tGenerating Expression files')
-        generate_expression_file(generated_files_folder, config_info, taxon_id_fms_subtype_map, upload, validate)
+        tasks.append(('Expression', partial(generate_expression_file, generated_files_folder, config_info, upload, validate)))
     if db_summary is True or all_filetypes is True:
         click.echo('INFO:\tGenerating DB summary file')
-        generate_db_summary_file(generated_files_folder, config_info, upload, validate)
-    if gene_cross_reference is True or all_filetypes is True:
+        tasks.append(('DB Summary', partial(generate_db_summary_file, generated_files_folder, config_info, upload, validate)))
+    if (gene_cross_reference is True or all_filetypes is True) and (uniprot is True or all_filetypes is True):
+        click.echo('INFO:\tGenerating Gene Cross Reference file')
+        click.echo('INFO:\tUniprot Cross Reference file')
+        tasks.append(('Gene and UniProt Cross Reference', partial(generate_gene_cross_reference_file,
+                                                                  generated_files_folder,
+                                                                  config_info,
+                                                                  upload,
+                                                                  validate,
+                                                                  uniprot=True)))
+    elif gene_cross_reference is True or all_filetypes is True:
         click.echo('INFO:\tGenerating Gene Cross Reference file')
-        generate_gene_cross_reference_file(generated_files_folder, config_info, upload, validate)
-    if uniprot is True or all_filetypes is True:
+        tasks.append(('Gene Cross Reference', partial(generate_gene_cross_reference_file, generated_files_folder, config_info, upload, validate)))
+    elif uniprot is True or all_filetypes is True:
         click.echo('INFO:\tUniprot Cross Reference file')
-        generate_uniprot_cross_reference(generated_files_folder, config_info, upload, validate)
+        tasks.append(('UniProt Cross Reference', partial(generate_uniprot_cross_reference, generated_files_folder, config_info, upload, validate)))
     if human_genes_interacting_with is True or all_filetypes is True:
         click.echo('INFO:\tHuman Genes Interacting With file')
-        generate_human_genes_interacting_with(generated_files_folder, config_info, upload, validate)
+        tasks.append(('Human Genes Interacting With', partial(generate_human_genes_interacting_with, generated_files_folder, config_info, upload, validate)))
     if allele_gff is True or all_filetypes is True:
         click.echo('INFO:\tAllele GFF files')
-        generate_allele_gff(generated_files_folder, config_info, upload, validate)
+        tasks.append(('Allele GFF', partial(generate_allele_gff, generated_files_folder, config_info, upload, validate)))
+
+    try:
+        failed = run_tasks(tasks, jobs, description='file types')
+    finally:
+        DataSource.close_drivers()
+        failed_uploads = UploadManager.shutdown()
 
     end_time = time.time()
     elapsed_time = end_time - start_time
     click.echo('File Generator finished. Elapsed time: %s' % time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
 
+    if failed or failed_uploads:
+        exit(-1)
+
 
 def generate_variant_allele_species_file(species_id, generated_files_folder, skip_chromosomes, config_info, upload_flag, validate_flag):
     logger.info("Querying Species: " + species_id)
@@ -240,20 +291,26 @@ def generate_variant_allele_files(generated_files_folder, skip_chromosomes, conf
         start_time = time.time()
         logger.info("Start time for generating Variant Alleles files: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
+    tasks = []
     for species_result in species_data_source:
         species = species_result["speciesID"]
-        generate_variant_allele_species_file(species,
-                                             generated_files_folder,
-                                             skip_chromosomes,
-                                             config_info,
-                                             upload_flag,
-                                             validate_flag)
+        tasks.append((species, partial(generate_variant_allele_species_file,
+                                       species,
+                                       generated_files_folder,
+                                       skip_chromosomes,
+                                       config_info,
+                                       upload_flag,
+                                       validate_flag)))
+    failed = run_tasks(tasks, int(config_info.config['partition_threads']), description='Variant Allele species')
 
     if config_info.config["DEBUG"]:
         end_time = time.time()
         logger.info("Created Variant Allele files - End time: %s", time.strftime("%H:%M:%S", time.gmtime(end_time)))
         logger.info("Time Elapsed: %s", time.strftime("%H:%M:%S", time.gmtime(end_time - start_time)))
 
+    if failed:
+        raise RuntimeError("Variant Allele generation failed for species: " + ', '.join(failed))
+
 
 def generate_vcf_file(assembly, generated_files_folder, skip_chromosomes, config_info, upload_flag, validate_flag):
     logger.info("Querying Assembly: " + assembly)
@@ -305,7 +362,10 @@ def generate_vcf_file(assembly, generated_files_folder, skip_chromosomes, config
     gvf = vcf_file_generator.VcfFileGenerator(data_source,
                                               generated_files_folder,
                                               config_info)
-    gvf.generate_files(skip_chromosomes=skip_chromosomes, upload_flag=upload_flag, validate_flag=validate_flag)
+    # Environment overrides arrive as strings
+    write_uncompressed = str(config_info.config['write_uncompressed_vcf']).lower() == 'true'
+    gvf.generate_files(skip_chromosomes=skip_chromosomes, upload_flag=upload_flag, validate_flag=validate_flag,
+                       write_uncompressed=write_uncompressed)
 
     if config_info.config["DEBUG"]:
         end_time = time.time()
@@ -322,21 +382,27 @@ def generate_vcf_files(generated_files_folder, skip_chromosomes, config_info, up
         start_time = time.time()
         logger.info("Start time for generating VCF files: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
+    tasks = []
     for assembly_result in assembly_data_source:
         assembly = assembly_result["assemblyID"]
         if assembly not in ignore_assemblies:
-            generate_vcf_file(assembly,
-                              generated_files_folder,
-                              skip_chromosomes,
-                              config_info,
-                              upload_flag,
-                              validate_flag)
+            tasks.append((assembly, partial(generate_vcf_file,
+                                            assembly,
+                                            generated_files_folder,
+                                            skip_chromosomes,
+                                            config_info,
+                                            upload_flag,
+                                            validate_flag)))
+    failed = run_tasks(tasks, int(config_info.config['partition_threads']), description='VCF assemblies')
 
     if config_info.config["DEBUG"]:
         end_time = time.time()
         logger.info("Created VCF files - End time: %s", time.strftime("%H:%M:%S", time.gmtime(end_time)))
         logger.info("Time Elapsed: %s", time.strftime("%H:%M:%S", time.gmtime(end_time - start_time)))
 
+    if failed:
+        raise RuntimeError("VCF generation failed for assemblies: " + ', '.join(failed))
+
 
 def generate_orthology_file(generated_files_folder, config_info, upload_flag, validate_flag):
     orthology_query = '''MATCH (species1)<-[sa:FROM_SPECIES]-(gene1:Gene)-[o:ORTHOLOGOUS]->(gene2:Gene)-[sa2:FROM_SPECIES]->(species2:Species)
@@ -365,7 +431,8 @@ def generate_orthology_file(generated_files_folder, config_info, upload_flag, va
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), orthology_query)
+    data_source = DataSource(get_neo_uri(config_info), orthology_query,
+                             fetch_size=int(config_info.config['NEO4J_BULK_FETCH_SIZE']))
     of = orthology_file_generator.OrthologyFileGenerator(data_source,
                                                          generated_files_folder,
                                                          config_info)
@@ -377,7 +444,7 @@ def generate_orthology_file(generated_files_folder, config_info, upload_flag, va
         logger.info("Time Elapsed: %s", time.strftime("%H:%M:%S", time.gmtime(end_time - start_time)))
 
 
-def generate_disease_file(generated_files_folder, config_info, taxon_id_fms_subtype_map, upload_flag, validate_flag):
+def generate_disease_file(generated_files_folder, config_info, upload_flag, validate_flag):
     disease_query = '''MATCH (disease:DOTerm)-[:ASSOCIATION]-(dej:Association:DiseaseEntityJoin)-[:ASSOCIATION]-(object)-[:FROM_SPECIES]-(species:Species)
                    WHERE (object:Gene OR object:Allele OR object:AffectedGenomicModel)
                          AND dej.joinType IN ["IS_MARKER_FOR", // need to remove when removed from database
@@ -440,7 +507,7 @@ def generate_disease_file(generated_files_folder, config_info, taxon_id_fms_subt
     disease = disease_file_generator.DiseaseFileGenerator(data_source,
                                                           generated_files_folder,
                                                           config_info,
-                                                          taxon_id_fms_subtype_map)
+                                                          get_taxonomy_subtype_map())
     disease.generate_file(upload_flag=upload_flag, validate_flag=validate_flag)
 
     if config_info.config["DEBUG"]:
@@ -449,7 +516,7 @@ def generate_disease_file(generated_files_folder, config_info, taxon_id_fms_subt
         logger.info("Time Elapsed: %s", time.strftime("%H:%M:%S", time.gmtime(end_time - start_time)))
 
 
-def generate_expression_file(generated_files_folder, config_info, taxon_id_fms_subtype_map, upload_flag, validate_flag):
+def generate_expression_file(generated_files_folder, config_info, upload_flag, validate_flag):
     expression_query = '''MATCH (speciesObj:Species)<-[:FROM_SPECIES]-(geneObj:Gene)-[:ASSOCIATION]->(begej:BioEntityGeneExpressionJoin)--(term)
                           WITH {primaryKey: speciesObj.primaryKey, name: speciesObj.name} AS species,
                                 {primaryKey: geneObj.primaryKey, symbol: geneObj.symbol, dataProvider: geneObj.dataProvider} AS gene,
@@ -475,7 +542,7 @@ def generate_expression_file(generated_files_folder, config_info, taxon_id_fms_s
     expression = expression_file_generator.ExpressionFileGenerator(data_source,
                                                                    generated_files_folder,
                                                                    config_info,
-                                                                   taxon_id_fms_subtype_map)
+                                                                   get_taxonomy_subtype_map())
     expression.generate_file(upload_flag=upload_flag, validate_flag=validate_flag)
 
     if config_info.config["DEBUG"]:
@@ -508,7 +575,11 @@ def generate_db_summary_file(generated_files_folder, config_info, upload_flag, v
         logger.info("Time Elapsed: %s", time.strftime("%H:%M:%S", time.gmtime(end_time - start_time)))
 
 
-def generate_gene_cross_reference_file(generated_files_folder, config_info, upload_flag, validate_flag):
+def is_uniprot_cross_reference(record):
+    return (record['GlobalCrossReferenceID'] or '').startswith('UniProtKB:')
+
+
+def generate_gene_cross_reference_file(generated_files_folder, config_info, upload_flag, validate_flag, uniprot=False):
     gene_cross_reference_query = '''MATCH (g:Gene)--(cr:CrossReference)
                           RETURN g.primaryKey as GeneID,
                                  cr.globalCrossRefId as GlobalCrossReferenceID,
@@ -522,7 +593,10 @@ def generate_gene_cross_reference_file(generated_files_folder, config_info, uplo
         start_time = time.time()
         logger.info("Start time: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
-    data_source = DataSource(get_neo_uri(config_info), gene_cross_reference_query)
+    data_source = DataSource(get_neo_uri(config_info), gene_cross_reference_query,
+                             fetch_size=int(config_info.config['NEO4J_BULK_FETCH_SIZE']))
+    if uniprot:
+        data_source = TeeDataSource(data_source, is_uniprot_cross_reference)
     gene_cross_reference = gene_cross_reference_file_generator.GeneCrossReferenceFileGenerator(data_source,
                                                                                                generated_files_folder,
                                                                                                config_info)
@@ -533,6 +607,10 @@ def generate_gene_cross_reference_file(generated_files_folder, config_info, uplo
         logger.info("Gene Cross Reference file - End time: %s", time.strftime("%H:%M:%S", time.gmtime(end_time)))
         logger.info("Time Elapsed: %s", time.strftime("%H:%M:%S", time.gmtime(end_time - start_time)))
 
+    if uniprot:
+        ucf = uniprot_cross_reference_generator.UniProtGenerator(data_source.matches, config_info, generated_files_folder)
+        ucf.generate_file(upload_flag=upload_flag, validate_flag=validate_flag)
+
 
 def generate_uniprot_cross_reference(generated_files_folder, config_info, upload_flag, validate_flag):
     uniprot_cross_reference_query = '''MATCH (s:Species)-[:FROM_SPECIES]-(g:Gene)--(cr:CrossReference)
@@ -633,20 +711,26 @@ def generate_allele_gff(generated_files_folder, config_info, upload_flag, valida
         start_time = time.time()
         logger.info("Start time for generating Allele GFF files: %s", time.strftime("%H:%M:%S", time.gmtime(start_time)))
 
+    tasks = []
     for assembly_result in assembly_data_source:
         assembly = assembly_result["assemblyID"]
         if assembly not in ignore_assemblies:
-            generate_allele_gff_assembly(assembly,
-                                         generated_files_folder,
-                                         config_info,
-                                         upload_flag,
-                                         validate_flag)
+            tasks.append((assembly, partial(generate_allele_gff_assembly,
+                                            assembly,
+                                            generated_files_folder,
+                                            config_info,
+                                            upload_flag,
+                                            validate_flag)))
+    failed = run_tasks(tasks, int(config_info.config['partition_threads']), description='Allele GFF assemblies')
 
     if config_info.config["DEBUG"]:
         end_time = time.time()
         logger.info("Created Allele GFF files - End time: %s", time.strftime("%H:%M:%S", time.gmtime(end_time)))
         logger.info("Time Elapsed: %s", time.strftime("%H:%M:%S", time.gmtime(end_time - start_time)))
 
+    if failed:
+        raise RuntimeError("Allele GFF generation failed for assemblies: " + ', '.join(failed))
+
 
 if __name__ == '__main__':
     main()
@@ -1,15 +1,25 @@
 import os
 
+import json
+import hashlib
 import requests
 import yaml
+import time
 import logging
+import threading
 import subprocess
+from datetime import datetime
 from collections import OrderedDict
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from data_source import DataSource
 
 logger = logging.getLogger(__name__)
 
+# Captured once so every file of a run carries the same generation time.
+run_time = time.gmtime()
+
 
 # Common configuration variables used throughout the script.
 class ContextInfo(object):
@@ -36,12 +46,64 @@ class ContextInfo(object):
 def run_command(cmd):
     logger.info('Running ' + cmd)
     process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    process.wait()
     stdout, stderr = process.communicate()
 
     return stdout, stderr, process.returncode
 
 
+def run_tasks(tasks, max_workers, description='tasks'):
+    """Run (name, callable) pairs on a pool of at most `max_workers` threads.
+
+    A task that raises (or calls exit) is logged and does not stop the others.
+    Once everything has finished a single summary is logged.
+
+    :param tasks: iterable of (name, callable) pairs
+    :param max_workers: upper bound on tasks running at the same time
+    :param description: label used in the log messages
+    :return: names of the tasks that failed
+    """
+
+    def timed(task):
+        task_start = time.time()
+        task()
+        return time.time() - task_start
+
+    tasks = list(tasks)
+    elapsed = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(timed, task): name for (name, task) in tasks}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                elapsed[name] = future.result()
+            except (Exception, SystemExit):
+                logger.exception('{}: {} failed'.format(description, name))
+                failed.append(name)
+
+    logger.info('Finished {} of {} {}'.format(len(elapsed), len(tasks), description))
+    for (name, seconds) in sorted(elapsed.items(), key=lambda item: -item[1]):
+        logger.info('    {}: {}'.format(name, time.strftime("%H:%M:%S", time.gmtime(seconds))))
+    if failed:
+        logger.error('Failed {}: {}'.format(description, ', '.join(failed)))
+
+    return failed
+
+
+def run_timestamp(date_format="%Y-%m-%d"):
+    """The time the run started (UTC) in `date_format`."""
+    return time.strftime(date_format, run_time)
+
+
+@lru_cache(maxsize=4096)
+def normalize_date(date_str, input_format="%Y-%m-%d", output_format="%Y%m%d"):
+    """Reformat a date string, raising ValueError if it is not a valid date.
+
+    Memoized, since the same few dates repeat across millions of rows.
+    """
+    return datetime.strptime(date_str, input_format).strftime(output_format)
+
+
 def get_neo_uri(config_info):
     if config_info.config['NEO4J_HOST']:
         uri = "bolt://" + config_info.config['NEO4J_HOST'] + ":" + str(config_info.config['NEO4J_PORT'])
@@ -53,44 +115,212 @@ def get_neo_uri(config_info):
         exit()
 
 
-def get_ordered_species_dict(config_info, taxon_ids):
+class ReferenceData:
+    """Species and assembly metadata, loaded once per run and shared by all generators.
+
+    Each dataset is fetched the first time it is asked for, under a lock of
+    its own so a slow load does not hold up tasks needing other datasets.
+    When `snapshot_path` is set, datasets are read from and saved to that JSON
+    file, so repeated runs and offline tests never refetch them; delete the
+    file to refresh it. The snapshot records the `release` it was taken for
+    and is ignored by runs of any other release. Downloaded files are cached
+    in `cache_dir`, see download_cached.
+    """
+
+    snapshot_path = None
+    species_yaml_path = None
+    cache_dir = None
+    release = None
+
+    _datasets = {}
+    _locks = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name, loader):
+        if name in cls._datasets:
+            return cls._datasets[name]
+        with cls._lock:
+            name_lock = cls._locks.setdefault(name, threading.Lock())
+        with name_lock:
+            if name not in cls._datasets:
+                snapshot = cls._read_snapshot()
+                if name in snapshot:
+                    dataset = snapshot[name]
+                else:
+                    dataset = loader()
+                    if cls.snapshot_path:
+                        cls._save_to_snapshot(name, dataset)
+                cls._datasets[name] = dataset
+            return cls._datasets[name]
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._datasets.clear()
+
+    @classmethod
+    def _read_snapshot(cls):
+        if not cls.snapshot_path or not os.path.exists(cls.snapshot_path):
+            return {}
+        with open(cls.snapshot_path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        if 'datasets' not in snapshot or snapshot.get('release') != cls.release:
+            logger.info('Ignoring reference data snapshot ' + cls.snapshot_path + ' taken for release ' + str(snapshot.get('release')))
+            return {}
+        return snapshot['datasets']
+
+    @classmethod
+    def _save_to_snapshot(cls, name, dataset):
+        with cls._lock:
+            datasets = cls._read_snapshot()
+            datasets[name] = dataset
+            logger.info('Saving reference data snapshot to ' + cls.snapshot_path)
+            with open(cls.snapshot_path + '.tmp', 'w') as snapshot_file:
+                json.dump({'release': cls.release, 'datasets': datasets}, snapshot_file, indent=4, default=str)
+            os.replace(cls.snapshot_path + '.tmp', cls.snapshot_path)
+
+
+def download(url):
+    logger.info('Reading in ' + url)
+    response = requests.get(url)
+
+    if response.status_code == 200:
+        return response.content
+    else:
+        logger.critical('unable to download ' + url + ' with status code: ' + str(response.status_code))
+        exit(-1)
+
+
+def download_cached(url, cache_path):
+    """Download `url`, keeping a copy at `cache_path` for later runs.
+
+    The copy is saved with its sha256 and the server's ETag. Later runs send
+    the ETag back and reuse the copy while the server answers 304 Not
+    Modified, or when the server cannot be reached. A copy whose content no
+    longer matches its sha256 is ignored.
+    """
+    metadata_path = cache_path + '.json'
+    cached = None
+    if os.path.exists(cache_path) and os.path.exists(metadata_path):
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+        with open(cache_path, 'rb') as cache_file:
+            content = cache_file.read()
+        if hashlib.sha256(content).hexdigest() == metadata.get('sha256'):
+            cached = (content, metadata)
+        else:
+            logger.warning('Ignoring ' + cache_path + ', its content does not match its sha256')
+
+    headers = {}
+    if cached and cached[1].get('etag'):
+        headers['If-None-Match'] = cached[1]['etag']
+    logger.info('Reading in ' + url)
+    try:
+        response = requests.get(url, headers=headers)
+        status = response.status_code
+    except requests.exceptions.RequestException as e:
+        response = None
+        status = str(e)
+    if cached and status == 304:
+        logger.info(url + ' unchanged, using ' + cache_path)
+        return cached[0]
+    if status != 200:
+        if cached:
+            logger.warning('unable to download ' + url + ' (' + str(status) + '), using ' + cache_path)
+            return cached[0]
+        logger.critical('unable to download ' + url + ': ' + str(status))
+        exit(-1)
+
+    content = response.content
+    metadata = {'url': url,
+                'sha256': hashlib.sha256(content).hexdigest(),
+                'etag': response.headers.get('ETag')}
+    if cached and cached[1]['sha256'] != metadata['sha256']:
+        logger.info(url + ' changed since it was cached, updating ' + cache_path)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path + '.tmp', 'wb') as cache_file:
+        cache_file.write(content)
+    os.replace(cache_path + '.tmp', cache_path)
+    with open(metadata_path + '.tmp', 'w') as metadata_file:
+        json.dump(metadata, metadata_file, indent=4)
+    os.replace(metadata_path + '.tmp', metadata_path)
+    return content
+
+
+def download_yaml(url):
+    return yaml.load(download(url), Loader=yaml.FullLoader)
+
+
+def _query_species(config_info):
     species_query = """MATCH (s:Species)
                        RETURN s
                        ORDER BY s.phylogeneticOrder"""
     species_data_source = DataSource(get_neo_uri(config_info), species_query)
+    return [[record["s"]["primaryKey"], record["s"]["name"]] for record in species_data_source]
+
+
+def _download_assembly_taxon_ids():
+    assemblies_url = 'https://raw.githubusercontent.com/alliance-genome/agr_schemas/master/ingest/assembly.yaml'
+    assembly_taxon_ids = {}
+    for record in download_yaml(assemblies_url):
+        for assemblies_record in record['assemblies']:
+            if 'name' in assemblies_record:
+                assembly_taxon_ids.setdefault(assemblies_record['name'], record['taxonId'])
+    return assembly_taxon_ids
+
+
+SPECIES_YAML_URL = 'https://raw.githubusercontent.com/alliance-genome/agr_schemas/master/ingest/species/species.yaml'
+
+
+def _load_species_yaml():
+    if ReferenceData.species_yaml_path:
+        logger.info('Reading in ' + ReferenceData.species_yaml_path)
+        with open(ReferenceData.species_yaml_path, 'rb') as species_file:
+            content = species_file.read()
+    elif ReferenceData.cache_dir:
+        content = download_cached(SPECIES_YAML_URL, os.path.join(ReferenceData.cache_dir, 'species.yaml'))
+    else:
+        content = download(SPECIES_YAML_URL)
+    sha256 = hashlib.sha256(content).hexdigest()
+    logger.info('Loaded species.yaml with sha256 ' + sha256)
+    return {'sha256': sha256,
+            'species': yaml.load(content, Loader=yaml.SafeLoader)}
+
+
+def get_species_yaml():
+    """The species records of the agr_schemas species.yaml data dictionary.
+
+    The file is read at most once per run, from ReferenceData.species_yaml_path
+    when that is set (for air-gapped builds) and from GitHub otherwise. The
+    download is cached in ReferenceData.cache_dir and only fetched again once
+    GitHub reports that it changed.
+    """
+    return ReferenceData.get('species_yaml', _load_species_yaml)['species']
+
+
+def get_taxonomy_subtype_map():
+    """Get a map linking taxonomy IDs (keys) to FMS subtype names (values)."""
+    return dict((item['taxonId'], item['fmsSubtypeName']) for item in get_species_yaml())
+
+
+def get_ordered_species_dict(config_info, taxon_ids):
     species = OrderedDict()
-    for record in species_data_source:
-        if record["s"]["primaryKey"] in taxon_ids:
-            species[record["s"]["primaryKey"]] = record["s"]["name"]
+    for (taxon_id, name) in ReferenceData.get('species', partial(_query_species, config_info)):
+        if taxon_id in taxon_ids:
+            species[taxon_id] = name
 
     return species
 
 
 def get_taxon_id_from_assembly(assembly):
-    assemblies_url = 'https://raw.githubusercontent.com/alliance-genome/agr_schemas/master/ingest/assembly.yaml'
-    response = requests.get(assemblies_url)
-
-    if response.status_code == 200:
-        assemblies_yaml = yaml.load(response.content, Loader=yaml.FullLoader)
-        for record in assemblies_yaml:
-            for assemblies_record in record['assemblies']:
-                if 'name' in assemblies_record and assemblies_record['name'] == assembly:
-                    return record['taxonId']
+    return ReferenceData.get('assemblies', _download_assembly_taxon_ids).get(assembly)
 
 
 def ordered_taxon_species_map_from_data_dictionary(taxon_ids):
-    species_url = 'https://raw.githubusercontent.com/alliance-genome/agr_schemas/master/ingest/species/species.yaml'
-    logger.info('Reading in ' + species_url)
-    response = requests.get(species_url)
-
-    if response.status_code == 200:
-        species_yaml = yaml.load(response.content, Loader=yaml.FullLoader)
-        species = OrderedDict()
-        for species_obj in sorted(species_yaml, key=lambda x: x['phylogenicOrder']):
-            if species_obj['taxonId'] in taxon_ids:
-                species[species_obj['taxonId']] = species_obj['fullName']
+    species = OrderedDict()
+    for species_obj in sorted(get_species_yaml(), key=lambda x: x['phylogenicOrder']):
+        if species_obj['taxonId'] in taxon_ids:
+            species[species_obj['taxonId']] = species_obj['fullName']
 
-        return species
-    else:
-        logger.critical('unable to download ' + species_url + ' with status code: ' + str(response.status_code))
-        exit(-1)
+    return species
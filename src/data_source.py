@@ -1,47 +1,267 @@
-import yaml
-import requests
+import os
+import gzip
+import json
+import hashlib
+import itertools
+import logging
+import tempfile
+import threading
 
 from neo4j import GraphDatabase
 
+logger = logging.getLogger(name=__name__)
+
+
+class QueryCache:
+    """Gzipped JSON lines files holding the records of completed queries.
+
+    Entries are keyed by URI, release and query text, so a rerun of the same
+    release replays results from disk instead of contacting Neo4j. Hits
+    refresh an entry's modification time and the least recently used entries
+    are evicted once the directory grows past `max_size` bytes.
+    """
+
+    suffix = '.jsonl.gz'
+
+    def __init__(self, directory, release, max_size):
+        self.directory = directory
+        self.release = release
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, uri, query):
+        digest = hashlib.sha256('\0'.join([uri, self.release, query]).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, self.release + '-' + digest + self.suffix)
+
+    def read(self, path):
+        """Return an iterator over the cached records at `path`, or None on a miss."""
+        try:
+            cache_file = gzip.open(path, 'rt')
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return self._replay(cache_file)
+
+    @staticmethod
+    def _replay(cache_file):
+        with cache_file:
+            for line in cache_file:
+                yield json.loads(line)
+
+    def write(self, path, records):
+        """Yield `records` while saving them; the entry is only kept if all are consumed."""
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        completed = False
+        try:
+            with gzip.open(os.fdopen(fd, 'wb'), 'wt') as cache_file:
+                for record in records:
+                    try:
+                        line = json.dumps(record)
+                    except TypeError:
+                        logger.warning('Not caching %s - records are not JSON serializable', os.path.basename(path))
+                        yield record
+                        yield from records
+                        return
+                    cache_file.write(line + '\n')
+                    yield record
+            completed = True
+        finally:
+            if completed:
+                os.replace(tmp_path, path)
+                self.evict()
+            else:
+                os.remove(tmp_path)
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.directory, name)))
+        return sorted(entries)
+
+    def evict(self):
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for (_, size, _) in entries)
+            for (_, size, path) in entries:
+                if total <= self.max_size:
+                    break
+                logger.info('Evicting cached query results %s', os.path.basename(path))
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self, release=None):
+        """Remove every entry, or only those of `release`."""
+        with self._lock:
+            for (_, _, path) in self.entries():
+                if release is None or os.path.basename(path).startswith(release + '-'):
+                    os.remove(path)
+
+
 class DataSource:
 
-    def __init__(self, uri, query):
+    max_connection_pool_size = 50
+    fetch_size = 1000
+    cache = None
+
+    _drivers = {}
+    _drivers_lock = threading.Lock()
+
+    def __init__(self, uri, query, fetch_size=None):
         self.uri = uri
-        self.driver = GraphDatabase.driver(self.uri)
+        self.driver = self.get_driver(self.uri)
         self.query = query
+        if fetch_size is not None:
+            self.fetch_size = fetch_size
 
     def __repr__(self):
         s = '\n'.join(['<' + self.__class__.__qualname__ + '({uri},', '{query})'])
         return s.format(**dict((k, repr(v)) for (k, v) in vars(self).items()))
 
+    def _session(self):
+        return self.driver.session(fetch_size=self.fetch_size)
+
     def __iter__(self):
-        with self.driver.session() as session:
+        if self.cache is None:
+            return self._run()
+        path = self.cache.path(self.uri, self.query)
+        records = self.cache.read(path)
+        if records is None:
+            records = self.cache.write(path, self._run())
+        return records
+
+    def _run(self):
+        with self._session() as session:
             with session.begin_transaction() as tx:
                 for record in tx.run(self.query):
                     yield record.data()
 
+    def batches(self, size=None, columns=False):
+        """Yield the results in chunks of up to `size` records, `fetch_size` by default.
+
+        Each chunk is a list of ``record.data()`` dicts or, with `columns`, a dict
+        mapping every returned key to the list of its values in the chunk.
+        """
+        size = size or self.fetch_size
+        if self.cache is not None:
+            yield from self._chunks(iter(self), size, columns)
+            return
+        with self._session() as session:
+            with session.begin_transaction() as tx:
+                result = tx.run(self.query)
+                keys = result.keys()
+                while True:
+                    records = result.fetch(size)
+                    if not records:
+                        break
+                    if columns:
+                        yield dict((key, [record[key] for record in records]) for key in keys)
+                    else:
+                        yield [record.data() for record in records]
+
+    @staticmethod
+    def _chunks(records, size, columns):
+        while True:
+            chunk = list(itertools.islice(records, size))
+            if not chunk:
+                break
+            if columns:
+                yield dict((key, [record[key] for record in chunk]) for key in chunk[0])
+            else:
+                yield chunk
+
     def get_data(self):
-        with self.driver.session() as session:
+        with self._session() as session:
             with session.begin_transaction() as tx:
                 return list(tx.run(self.query))
 
-    def get_taxonomy_subtype_map():
-        """Get a map linking taxonomy IDs (keys) to FMS subtype names (values).
+    @classmethod
+    def get_driver(cls, uri):
+        """Return the process-wide driver for `uri`, creating it on first use.
 
-        These are stored in the species.yaml file in the agr_schemas repository.
+        Every DataSource for the same URI shares one driver and therefore one
+        Bolt connection pool, so generators no longer pay a handshake per query.
         """
-        taxonomy_subtype_map = dict()
+        with cls._drivers_lock:
+            driver = cls._drivers.get(uri)
+            if driver is None:
+                driver = GraphDatabase.driver(uri, max_connection_pool_size=cls.max_connection_pool_size)
+                cls._drivers[uri] = driver
+            return driver
+
+    @classmethod
+    def close_drivers(cls):
+        """Close every pooled driver. Call once, when no more queries will run."""
+        with cls._drivers_lock:
+            for driver in cls._drivers.values():
+                driver.close()
+            cls._drivers.clear()
+
+
+class PeekableDataSource:
+    """Single-pass view of a DataSource that can be tested for emptiness.
+
+    The query runs once, when the wrapper is first peeked at or iterated;
+    records looked at by ``peek()`` or ``bool()`` are handed out again by the
+    iteration, so callers can check for results and then stream all of them.
+    """
 
-        url = 'https://raw.githubusercontent.com/alliance-genome/agr_schemas/master/ingest/species/species.yaml'
+    _exhausted = object()
 
-        species_stream = requests.get(url, stream=True)
+    def __init__(self, data_source):
+        self.data_source = data_source
+        self._iterator = None
+        self._head = None
 
-        if species_stream.encoding is None:
-            species_stream.encoding = 'utf-8'
+    def _fill(self):
+        if self._iterator is None:
+            self._iterator = iter(self.data_source)
+            self._head = next(self._iterator, self._exhausted)
 
-        yaml_list = yaml.load(species_stream.content, Loader=yaml.SafeLoader)
-        for item in yaml_list:
-            taxonomy_subtype_map[item['taxonId']] = item['fmsSubtypeName']
-            # taxonomy_subtype_map[item['taxonId']] = item['primaryDataProvider']['dataProviderShortName']
+    def peek(self, default=None):
+        self._fill()
+        return default if self._head is self._exhausted else self._head
+
+    def __bool__(self):
+        self._fill()
+        return self._head is not self._exhausted
+
+    def __iter__(self):
+        self._fill()
+        if self._head is not self._exhausted:
+            head, self._head = self._head, self._exhausted
+            yield head
+            yield from self._iterator
+
+
+class TeeDataSource:
+    """Pass the records of a DataSource through while keeping those matching `predicate`.
+
+    Lets a second, smaller output be built from the same query as a larger
+    one: once the wrapper has been consumed, ``matches`` holds the kept records.
+    """
+
+    def __init__(self, data_source, predicate):
+        self.data_source = data_source
+        self.predicate = predicate
+        self.matches = []
+
+    def __iter__(self):
+        for record in self.data_source:
+            if self.predicate(record):
+                self.matches.append(record)
+            yield record
 
-        return taxonomy_subtype_map
+    def batches(self, size=None, columns=False):
+        for batch in self.data_source.batches(size, columns):
+            records = [dict(zip(batch, values)) for values in zip(*batch.values())] if columns else batch
+            self.matches.extend(record for record in records if self.predicate(record))
+            yield batch
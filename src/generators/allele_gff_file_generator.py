@@ -2,6 +2,7 @@ import os
 import sys
 import logging
 import upload
+from data_source import PeekableDataSource
 from headers import create_header
 
 sys.path.append('../')
@@ -40,11 +41,9 @@ class AlleleGffFileGenerator:
     def generate_assembly_file(self, upload_flag=False, validate_flag=False):
         filename = self.assembly .replace('_', '') + '-' + self.config_info.config['RELEASE_VERSION'] + '.allele.gff'
         filepath = os.path.join(self.generated_files_folder, filename)
-        records_found = False
-        for allele in self.alleles:
-            records_found = True
+        alleles = PeekableDataSource(self.alleles)
 
-        if not records_found:
+        if not alleles:
             logger.info('Not Generatring Allele GFF File for assembly %r - no alleles with multiple variants found', self.assembly)
             return
 
@@ -57,7 +56,7 @@ class AlleleGffFileGenerator:
                                    data_format='GFF')
 
             allele_file.write(header)
-            for allele in self.alleles:
+            for allele in alleles:
                 variant_rows = []
                 allele_start = -1
                 allele_end = 0
@@ -9,17 +9,19 @@
 
 import os
 import logging
-from datetime import datetime
-from time import gmtime, strftime
-import json
-import csv
 
 import upload
+from common import normalize_date, run_timestamp
+from manifest import Manifest
 from headers import create_header
+from writers import JsonFileWriter, TsvFileWriter, MultiSink, PartitionedSink, join_list
 from validators import json_validator
 
 logger = logging.getLogger(name=__name__)
 
+# Associations inferred from orthologs; those without a dateAssigned are dated with the run date
+ORTHOLOGY_ASSOCIATION_TYPES = ["implicated_via_orthology", "biomarker_via_orthology"]
+
 
 class DiseaseFileGenerator:
     """
@@ -55,6 +57,106 @@ class DiseaseFileGenerator:
                              data_format=data_format,
                              stringency_filter='Stringent')
 
+    @staticmethod
+    def _association_template(disease_association, fields):
+        """Row fields shared by every evidence line of one association (dejID).
+
+        The evidence specific fields are left empty for _evidence_row to fill in.
+        """
+        if disease_association["objectType"][0] == "Feature":
+            db_object_type = "allele"
+        elif disease_association["objectType"][0] == "AffectedGenomicModel":
+            db_object_type = "affected_genomic_model"
+        else:
+            db_object_type = disease_association["objectType"][0].lower()
+
+        do_name = disease_association["DOtermName"] if disease_association["DOtermName"] else ""
+
+        modifiers = []
+        experimental_conditions = []
+        for condition in disease_association['experimentalConditions']:
+            condition_statement = ""
+            if condition["statement"]:
+                condition_statement = condition['statement']
+
+            if condition['type'] == "HAS_CONDITION":
+                experimental_conditions.append("Has Condition: " + condition_statement)
+            elif condition['type'] == "INDUCES":
+                experimental_conditions.append("Induced By: " + condition_statement)
+            elif condition['type'] == "AMELIORATES":
+                modifiers.append("Ameliorated By: " + condition_statement)
+            elif condition['type'] == "EXACERBATES":
+                modifiers.append("Exacerbated By: " + condition_statement)
+
+        if disease_association["dateAssigned"] is None and disease_association["associationType"] in ORTHOLOGY_ASSOCIATION_TYPES:
+            date = run_timestamp("%Y%m%d")
+        else:
+            date = normalize_date(disease_association["dateAssigned"])
+
+        if len(disease_association["source"]) > 1:
+            curatorDB = ""
+            sourceDB = ""
+            for source in disease_association["source"]:
+                if source['curatedDB']:
+                    curatorDB = source["displayName"]
+                else:
+                    sourceDB = source['displayName']
+            if curatorDB == sourceDB:
+                source = curatorDB
+            else:
+                source = curatorDB + " Via " + sourceDB
+        elif disease_association['source'][0]['displayName']:
+            source = disease_association["source"][0]["displayName"]
+        else:
+            source = disease_association["dataProvider"]
+
+        return dict(zip(fields, [disease_association["taxonId"],
+                                 disease_association["speciesName"],
+                                 db_object_type,
+                                 disease_association["dbObjectID"],
+                                 disease_association["dbObjectSymbol"] if disease_association["dbObjectSymbol"] else disease_association["dbObjectName"],
+                                 disease_association["associationType"].lower(),
+                                 disease_association["DOID"],
+                                 do_name,
+                                 disease_association["withOrthologs"],
+                                 "",
+                                 "",
+                                 experimental_conditions,
+                                 modifiers,
+                                 "",
+                                 "",
+                                 "",
+                                 date,
+                                 source]))
+
+    @staticmethod
+    def _evidence_row(template, evidence):
+        row = template.copy()
+
+        if evidence["inferredFromEntity"]:
+            row["InferredFromID"] = evidence["inferredFromEntity"]["primaryKey"]
+            if "symbol" in evidence["inferredFromEntity"]:
+                row["InferredFromSymbol"] = evidence["inferredFromEntity"]["symbol"]
+            elif "name" in evidence["inferredFromEntity"]:
+                row["InferredFromSymbol"] = evidence["inferredFromEntity"]["name"]
+            else:
+                logger.info("infferred from node not handled" + evidence["inferredFromEntity"]["primaryKey"])
+
+        if evidence["evidenceCode"] is not None:
+            row["EvidenceCode"] = evidence["evidenceCode"]
+        if evidence["evidenceCodeName"] is not None:
+            row["EvidenceCodeName"] = evidence["evidenceCodeName"]
+
+        pub_id = evidence["pubMedID"] if evidence["pubMedID"] else evidence["pubModID"]
+        if pub_id is not None:
+            row["Reference"] = pub_id
+
+        return row
+
+    @staticmethod
+    def _format_with_orthologs(with_orthologs):
+        return "|".join(set(with_orthologs)) if len(with_orthologs) > 1 else ""
+
     def generate_file(self, upload_flag=False, validate_flag=False):
         """
 
@@ -80,171 +182,96 @@ class DiseaseFileGenerator:
                   "Date",
                   "Source"]
 
-        processed_disease_associations = {}
-        processed_disease_associations_tsv = {}
-        species = {}
-        for disease_association in self.disease_associations:
-            for evidence in disease_association["evidence"]:
-                if evidence["otherAssociatedEntityID"]:
-                    continue
-
-                if disease_association["objectType"][0] == "Feature":
-                    db_object_type = "allele"
-                elif disease_association["objectType"][0] == "AffectedGenomicModel":
-                    db_object_type = "affected_genomic_model"
-                else:
-                    db_object_type = disease_association["objectType"][0].lower()
-
-                pub_id = evidence["pubMedID"] if evidence["pubMedID"] else evidence["pubModID"]
-                if pub_id is None:
-                    pub_id = ""
-
-                do_name = disease_association["DOtermName"] if disease_association["DOtermName"] else ""
-
-                if evidence["evidenceCode"] is not None:
-                    evidence_code = evidence["evidenceCode"]
-                else:
-                    evidence_code = ""
-
-                if evidence["evidenceCodeName"] is not None:
-                    evidence_code_name = evidence['evidenceCodeName']
-                else:
-                    evidence_code_name = ""
-
-                modifiers = []
-                experimental_conditions = []
-                for condition in disease_association['experimentalConditions']:
-                    condition_statement = ""
-                    if condition["statement"]:
-                        condition_statement = condition['statement']
-
-                    if condition['type'] == "HAS_CONDITION":
-                        experimental_conditions.append("Has Condition: " + condition_statement)
-                    elif condition['type'] == "INDUCES":
-                        experimental_conditions.append("Induced By: " + condition_statement)
-                    elif condition['type'] == "AMELIORATES":
-                        modifiers.append("Ameliorated By: " + condition_statement)
-                    elif condition['type'] == "EXACERBATES":
-                        modifiers.append("Exacerbated By: " + condition_statement)
-
-                if disease_association["dateAssigned"] is None and disease_association["associationType"] in ["implicated_via_orthology",
-                                                                                                              "biomarker_via_orthology"]:
-                    date_str = strftime("%Y-%m-%d", gmtime())
-                else:
-                    date_str = disease_association["dateAssigned"]
-
-                inferred_from_id = ""
-                inferred_from_symbol = ""
-                if evidence["inferredFromEntity"]:
-                    inferred_from_id = evidence["inferredFromEntity"]["primaryKey"]
-                    if "symbol" in evidence["inferredFromEntity"]:
-                        inferred_from_symbol = evidence["inferredFromEntity"]["symbol"]
-                    elif "name" in evidence["inferredFromEntity"]:
-                        inferred_from_symbol = evidence["inferredFromEntity"]["name"]
-                    else:
-                        logger.info("infferred from node not handled" + evidence["inferredFromEntity"]["primaryKey"])
-
-                taxon_id = disease_association["taxonId"]
-                species[taxon_id] = disease_association["speciesName"]
-
-                if len(disease_association["source"]) > 1:
-                    curatorDB = ""
-                    sourceDB = ""
-                    for source in disease_association["source"]:
-                        if source['curatedDB']:
-                            curatorDB = source["displayName"]
-                        else:
-                            sourceDB = source['displayName']
-                    if curatorDB == sourceDB:
-                        source = curatorDB
-                    else:
-                        source = curatorDB + " Via " + sourceDB
-                elif disease_association['source'][0]['displayName']:
-                    source = disease_association["source"][0]["displayName"]
-                else:
-                    source = disease_association["dataProvider"]
-
-                processed_association = dict(zip(fields, [taxon_id,
-                                                          disease_association["speciesName"],
-                                                          db_object_type,
-                                                          disease_association["dbObjectID"],
-                                                          disease_association["dbObjectSymbol"] if disease_association["dbObjectSymbol"] else disease_association["dbObjectName"],
-                                                          disease_association["associationType"].lower(),
-                                                          disease_association["DOID"],
-                                                          do_name,
-                                                          disease_association["withOrthologs"],
-                                                          inferred_from_id,
-                                                          inferred_from_symbol,
-                                                          experimental_conditions,
-                                                          modifiers,
-                                                          evidence_code,
-                                                          evidence_code_name,
-                                                          pub_id,
-                                                          datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y%m%d"),
-                                                          source]))
-                processed_association_tsv = processed_association.copy()
-                processed_association_tsv["WithOrtholog"] = "|".join(set(disease_association["withOrthologs"])) if len(disease_association["withOrthologs"]) > 1 else ""
-                processed_association_tsv["Modifier"] = "|".join(modifiers) if len(modifiers) else ""
-                processed_association_tsv["ExperimentalCondition"] = "|".join(experimental_conditions) if len(experimental_conditions) else ""
-
-                if taxon_id in processed_disease_associations:
-                    processed_disease_associations_tsv[taxon_id].append(processed_association_tsv)
-                    processed_disease_associations[taxon_id].append(processed_association)
-                else:
-                    processed_disease_associations_tsv[taxon_id] = [processed_association_tsv]
-                    processed_disease_associations[taxon_id] = [processed_association]
-
         file_basename = "agr-disease-" + self.config_info.config['RELEASE_VERSION']
         combined_file_basepath = os.path.join(self.generated_files_folder, file_basename + '.combined')
 
-        combined_filepath_tsv = combined_file_basepath + '.tsv'
-        combined_disease_file = open(combined_filepath_tsv, 'w')
-        combined_disease_file.write(self._generate_header(self.config_info, species, 'tsv'))
-        combined_tsv_writer = csv.DictWriter(combined_disease_file, delimiter='\t', fieldnames=fields, lineterminator="\n")
-        combined_tsv_writer.writeheader()
+        tsv_formatters = {"WithOrtholog": self._format_with_orthologs,
+                          "ExperimentalCondition": join_list("|"),
+                          "Modifier": join_list("|")}
 
+        combined_filepath_tsv = combined_file_basepath + '.tsv'
         combined_filepath_json = combined_file_basepath + '.json'
-        with open(combined_filepath_json, 'w') as outfile:
-            content = {'metadata': self._generate_header(self.config_info, species, 'json'),
-                       'data': sum(processed_disease_associations.values(), [])}
-            json.dump(content, outfile)
-
-        for taxon_id in processed_disease_associations:
-            combined_tsv_writer.writerows(processed_disease_associations_tsv[taxon_id])
+        run_date = run_timestamp("%Y%m%d")
+
+        def fingerprint_row(row):
+            # Leave the run date out, or these rows would look changed on every day's run
+            if row["Date"] == run_date and row["AssociationType"] in ORTHOLOGY_ASSOCIATION_TYPES:
+                return dict(row, Date=None)
+            return row
+
+        combined_fingerprint = Manifest.fingerprint(fingerprint_row)
+        combined_json_writer = JsonFileWriter(combined_filepath_json)
+        combined_tsv_writer = TsvFileWriter(combined_filepath_tsv, fields, formatters=tsv_formatters)
+        combined_json_checker = json_validator.RecordValidator(combined_json_writer, 'disease', active=validate_flag)
+        json_checkers = {}
+        fingerprints = {}
+
+        def open_taxon_sink(taxon_id):
+            fingerprints[taxon_id] = Manifest.fingerprint(fingerprint_row)
             taxon_file_basepath = os.path.join(self.generated_files_folder, file_basename + '.' + taxon_id)
-            taxon_filepath_json = taxon_file_basepath + '.json'
-            with open(taxon_filepath_json, 'w') as f:
-                contents = {'metadata': self._generate_header(self.config_info, [taxon_id], 'json'),
-                            'data': processed_disease_associations[taxon_id]}
-                json.dump(contents, f)
+            taxon_json_writer = JsonFileWriter(taxon_file_basepath + '.json', self._generate_header(self.config_info, [taxon_id], 'json'))
+            json_checkers[taxon_id] = json_validator.RecordValidator(taxon_json_writer, 'disease', active=validate_flag)
+            return MultiSink(taxon_json_writer,
+                             TsvFileWriter(taxon_file_basepath + '.tsv', fields, self._generate_header(self.config_info, [taxon_id], 'tsv'),
+                                           formatters=tsv_formatters),
+                             json_checkers[taxon_id],
+                             fingerprints[taxon_id])
+
+        species = {}
+        with PartitionedSink(open_taxon_sink, MultiSink(combined_json_writer,
+                                                        combined_tsv_writer,
+                                                        combined_json_checker,
+                                                        combined_fingerprint),
+                             max_open=int(self.config_info.config['max_open_partitions'])) as sink:
+            for disease_association in self.disease_associations:
+                evidence_list = [evidence for evidence in disease_association["evidence"] if not evidence["otherAssociatedEntityID"]]
+                if not evidence_list:
+                    continue
 
-            taxon_filename_tsv = taxon_file_basepath + '.tsv'
-            with open(taxon_filename_tsv, 'w') as f:
-                f.write(self._generate_header(self.config_info, [taxon_id], 'tsv'))
-                tsv_writer = csv.DictWriter(f, delimiter='\t', fieldnames=fields, lineterminator="\n")
-                tsv_writer.writeheader()
-                tsv_writer.writerows(processed_disease_associations_tsv[taxon_id])
+                template = self._association_template(disease_association, fields)
+                taxon_id = template["Taxon"]
+                species[taxon_id] = template["SpeciesName"]
+                for evidence in evidence_list:
+                    sink.write(taxon_id, self._evidence_row(template, evidence))
 
-        combined_disease_file.close()
+            combined_json_writer.metadata = self._generate_header(self.config_info, species, 'json')
+            combined_tsv_writer.header = self._generate_header(self.config_info, species, 'tsv')
 
         if validate_flag:
-            json_validator.JsonValidator(combined_filepath_json, 'disease').validateJSON()
-            if upload_flag:
-                logger.info("Submitting disease files to FMS")
-                process_name = "1"
-                upload.upload_process(process_name, combined_filepath_tsv, self.generated_files_folder, 'DISEASE-ALLIANCE', 'COMBINED', self.config_info)
-                upload.upload_process(process_name, combined_filepath_json, self.generated_files_folder, 'DISEASE-ALLIANCE-JSON', 'COMBINED', self.config_info)
-            for taxon_id in processed_disease_associations:
+            process_name = "1"
+            if not (upload_flag and Manifest.uploaded('DISEASE-ALLIANCE', 'COMBINED', combined_fingerprint)):
+                combined_json_checker.validateJSON()
+                if upload_flag:
+                    logger.info("Submitting disease files to FMS")
+                    uploads = [upload.upload_process(process_name,
+                                                     combined_filepath_tsv,
+                                                     self.generated_files_folder,
+                                                     'DISEASE-ALLIANCE',
+                                                     'COMBINED',
+                                                     self.config_info),
+                               upload.upload_process(process_name,
+                                                     combined_filepath_json,
+                                                     self.generated_files_folder,
+                                                     'DISEASE-ALLIANCE-JSON',
+                                                     'COMBINED',
+                                                     self.config_info)]
+                    Manifest.record_upload('DISEASE-ALLIANCE', 'COMBINED', combined_fingerprint, uploads)
+            for taxon_id in fingerprints:
+                if upload_flag and Manifest.uploaded('DISEASE-ALLIANCE', taxon_id, fingerprints[taxon_id]):
+                    continue
+                uploads = []
                 for file_extension in ['json', 'tsv']:
                     filename = file_basename + "." + taxon_id + '.' + file_extension
                     datatype = "DISEASE-ALLIANCE"
                     if file_extension == "json":
                         datatype += "-JSON"
-                        json_validator.JsonValidator(os.path.join(self.generated_files_folder, filename), 'disease').validateJSON()
+                        json_checkers[taxon_id].validateJSON()
                     if upload_flag:
-                        upload.upload_process(process_name,
-                                              filename,
-                                              self.generated_files_folder,
-                                              datatype,
-                                              self.taxon_id_fms_subtype_map[taxon_id],
-                                              self.config_info)
+                        uploads.append(upload.upload_process(process_name,
+                                                             filename,
+                                                             self.generated_files_folder,
+                                                             datatype,
+                                                             self.taxon_id_fms_subtype_map[taxon_id],
+                                                             self.config_info))
+                if upload_flag:
+                    Manifest.record_upload('DISEASE-ALLIANCE', taxon_id, fingerprints[taxon_id], uploads)
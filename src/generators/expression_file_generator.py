@@ -8,15 +8,140 @@
 
 import os
 import logging
-import json
-import csv
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+
 import upload
+from manifest import Manifest
 from headers import create_header
+from writers import JsonFileWriter, TsvFileWriter, MultiSink, PartitionedSink, join_list
 from validators import json_validator
 
 
 logger = logging.getLogger(name=__name__)
 
+FIELDS = ['Species',
+          'SpeciesID',
+          'GeneID',
+          'GeneSymbol',
+          'Location',
+          'StageTerm',
+          'AssayID',
+          'AssayTermName',
+          'CellularComponentID',
+          'CellularComponentTerm',
+          'CellularComponentQualifierIDs',
+          'CellularComponentQualifierTermNames',
+          'SubStructureID',
+          'SubStructureName',
+          'SubStructureQualifierIDs',
+          'SubStructureQualifierTermNames',
+          'AnatomyTermID',
+          'AnatomyTermName',
+          'AnatomyTermQualifierIDs',
+          'AnatomyTermQualifierTermNames',
+          'SourceURL',
+          'Source',
+          'Reference']
+
+
+# Terms are classified by the first of these labels they carry
+TERM_LABELS = ('CrossReference', 'Publication', 'Stage', 'MMOTerm')
+
+# Ontology path edge -> (ID field, name field, whether the edge can repeat)
+ONTOLOGY_EDGE_FIELDS = {
+    'ANATOMICAL_STRUCTURE': ('AnatomyTermID', 'AnatomyTermName', False),
+    'CELLULAR_COMPONENT': ('CellularComponentID', 'CellularComponentTerm', False),
+    'ANATOMICAL_SUB_SUBSTRUCTURE': ('SubStructureID', 'SubStructureName', False),
+    'CELLULAR_COMPONENT_QUALIFIER': ('CellularComponentQualifierIDs', 'CellularComponentQualifierTermNames', True),
+    'ANATOMICAL_SUB_STRUCTURE_QUALIFIER': ('SubStructureQualifierIDs', 'SubStructureQualifierTermNames', True),
+    'ANATOMICAL_STRUCTURE_QUALIFIER': ('AnatomyTermQualifierIDs', 'AnatomyTermQualifierTermNames', True),
+}
+
+
+@lru_cache(maxsize=None)
+def _term_label(labels):
+    for label in TERM_LABELS:
+        if label in labels:
+            return label
+    return None
+
+
+def _term_value(term, key):
+    # Node properties take precedence over the other keys of the term
+    properties = term.get('properties')
+    if properties and key in properties:
+        return properties[key]
+    return term[key]
+
+
+def transform_expression(expression):
+    """Turn one expression query record into a row of FIELDS."""
+    row = dict.fromkeys(FIELDS)
+    lists = {}
+    row['Species'] = expression['species']['name']
+    row['Source'] = expression['gene']['dataProvider']
+    row['SpeciesID'] = expression['species']['primaryKey']
+    row['GeneID'] = expression['gene']['primaryKey']
+    row['GeneSymbol'] = expression['gene']['symbol']
+    row['Location'] = expression['location']
+    for term in expression['terms']:
+        label = _term_label(tuple(_term_value(term, 'labels')))
+        if label == 'CrossReference':
+            # according to spec should use globalCrossRefId
+            lists.setdefault('SourceURL', []).append(_term_value(term, 'crossRefCompleteUrl'))
+        elif label == 'Publication':
+            lists.setdefault('Reference', []).append(_term_value(term, 'pubMedId') or _term_value(term, 'pubModId'))
+        elif label == 'Stage':
+            row['StageTerm'] = _term_value(term, 'name')
+        elif label == 'MMOTerm':
+            row['AssayID'] = _term_value(term, 'primaryKey')
+            row['AssayTermName'] = _term_value(term, 'name')
+    for ontology_path in expression['ontologyPaths']:
+        edge_fields = ONTOLOGY_EDGE_FIELDS.get(ontology_path['edge'])
+        if edge_fields is None:
+            continue
+        (id_field, name_field, repeated) = edge_fields
+        if repeated:
+            lists.setdefault(id_field, []).append(ontology_path['primaryKey'])
+            lists.setdefault(name_field, []).append(ontology_path['name'])
+        else:
+            row[id_field] = ontology_path['primaryKey']
+            row[name_field] = ontology_path['name']
+    row.update(lists)
+    return row
+
+
+def transform_expressions(expressions):
+    """transform_expression over a chunk of records, for running in a worker process."""
+    return [transform_expression(expression) for expression in expressions]
+
+
+def transformed_chunks(expressions, processes, chunk_size=5000):
+    """Yield the transformed rows of `expressions` in chunks, in order.
+
+    With more than one process the chunks are transformed in a process pool,
+    keeping at most two chunks per process in flight. Workers are started by a
+    forkserver rather than forked from this process, which has other threads
+    (generators, uploads) and an open Neo4j transaction.
+    """
+    chunks = iter(lambda: list(islice(expressions, chunk_size)), [])
+    if processes <= 1:
+        for chunk in chunks:
+            yield transform_expressions(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('forkserver')) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(transform_expressions, chunk))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 
 class ExpressionFileGenerator:
     """
@@ -58,164 +183,94 @@ class ExpressionFileGenerator:
         :param upload_flag:
         :return:
         """
-        fields = ['Species',
-                  'SpeciesID',
-                  'GeneID',
-                  'GeneSymbol',
-                  'Location',
-                  'StageTerm',
-                  'AssayID',
-                  'AssayTermName',
-                  'CellularComponentID',
-                  'CellularComponentTerm',
-                  'CellularComponentQualifierIDs',
-                  'CellularComponentQualifierTermNames',
-                  'SubStructureID',
-                  'SubStructureName',
-                  'SubStructureQualifierIDs',
-                  'SubStructureQualifierTermNames',
-                  'AnatomyTermID',
-                  'AnatomyTermName',
-                  'AnatomyTermQualifierIDs',
-                  'AnatomyTermQualifierTermNames',
-                  'SourceURL',
-                  'Source',
-                  'Reference']
-
-        associations = {}
-        species = {}
-        for expression in self.expressions:
-            association = dict(zip(fields, [None] * len(fields)))
-            association['Species'] = expression['species']['name']
-            association['Source'] = expression['gene']['dataProvider']
-            association['SpeciesID'] = expression['species']['primaryKey']
-            association['GeneID'] = expression['gene']['primaryKey']
-            association['GeneSymbol'] = expression['gene']['symbol']
-            association['Location'] = expression['location']
-            for term in expression['terms']:
-                # Flatten the dictionary structure.
-                term.update(term.pop('properties', {}))
-                
-                if 'CrossReference' in term['labels']:
-                    if association['SourceURL']:
-                        association['SourceURL'].append(term['crossRefCompleteUrl'])  # according to spec should use globalCrossRefId
-                    else:
-                        association['SourceURL'] = [term['crossRefCompleteUrl']]
-                elif 'Publication' in term['labels']:
-                    publication = term['pubMedId'] or term['pubModId']
-                    # reference = association['Reference']
-                    if association['Reference']:
-                        association['Reference'].append(publication)
-                    else:
-                        association['Reference'] = [publication]
-                elif 'Stage' in term['labels']:
-                    # association['StageID'] = term['primaryKey']
-                    association['StageTerm'] = term['name']
-                elif 'MMOTerm' in term['labels']:
-                    association['AssayID'] = term['primaryKey']
-                    association['AssayTermName'] = term['name']
-            for ontology_path in expression['ontologyPaths']:
-                if ontology_path['edge'] == 'ANATOMICAL_STRUCTURE':
-                    association['AnatomyTermID'] = ontology_path['primaryKey']
-                    association['AnatomyTermName'] = ontology_path['name']
-                elif ontology_path['edge'] == 'CELLULAR_COMPONENT':
-                    association['CellularComponentID'] = ontology_path['primaryKey']
-                    association['CellularComponentTerm'] = ontology_path['name']
-                elif ontology_path['edge'] == 'ANATOMICAL_SUB_SUBSTRUCTURE':
-                    association['SubStructureID'] = ontology_path['primaryKey']
-                    association['SubStructureName'] = ontology_path['name']
-                elif ontology_path['edge'] == 'CELLULAR_COMPONENT_QUALIFIER':
-                    if association['CellularComponentQualifierIDs']:
-                        association['CellularComponentQualifierIDs'].append(ontology_path['primaryKey'])
-                    else:
-                        association['CellularComponentQualifierIDs'] = [ontology_path['primaryKey']]
-                    if association['CellularComponentQualifierTermNames']:
-                        association['CellularComponentQualifierTermNames'].append(ontology_path['name'])
-                    else:
-                        association['CellularComponentQualifierTermNames'] = [ontology_path['name']]
-                elif ontology_path['edge'] == 'ANATOMICAL_SUB_STRUCTURE_QUALIFIER':
-                    if association['SubStructureQualifierIDs']:
-                        association['SubStructureQualifierIDs'].append(ontology_path['primaryKey'])
-                    else:
-                        association['SubStructureQualifierIDs'] = [ontology_path['primaryKey']]
-                    if association['SubStructureQualifierTermNames']:
-                        association['SubStructureQualifierTermNames'].append(ontology_path['name'])
-                    else:
-                        association['SubStructureQualifierTermNames'] = [ontology_path['name']]
-                elif ontology_path['edge'] == 'ANATOMICAL_STRUCTURE_QUALIFIER':
-                    if association['AnatomyTermQualifierIDs']:
-                        association['AnatomyTermQualifierIDs'].append(ontology_path['primaryKey'])
-                    else:
-                        association['AnatomyTermQualifierIDs'] = [ontology_path['primaryKey']]
-                    if association['AnatomyTermQualifierTermNames']:
-                        association['AnatomyTermQualifierTermNames'].append(ontology_path['name'])
-                    else:
-                        association['AnatomyTermQualifierTermNames'] = [ontology_path['name']]
-            taxon_id = association['SpeciesID']
-            species[taxon_id] = association['Species']
-            if taxon_id in associations:
-                associations[taxon_id].append(association)
-            else:
-                associations[taxon_id] = [association]
+
+        fields = FIELDS
 
         file_basename = "agr-expression-" + self.config_info.config['RELEASE_VERSION']
         combined_file_basepath = os.path.join(self.generated_files_folder, file_basename + '.combined')
 
-        combined_filepath_tsv = combined_file_basepath + '.tsv'
-        combined_expression_file = open(combined_filepath_tsv, 'w')
-        combined_expression_file.write(self._generate_header(self.config_info, species.keys(), 'tsv'))
-        combined_tsv_writer = csv.DictWriter(combined_expression_file, delimiter='\t', fieldnames=fields, lineterminator="\n")
-        combined_tsv_writer.writeheader()
+        tsv_formatters = dict.fromkeys(['SourceURL',
+                                        'Reference',
+                                        'CellularComponentQualifierIDs',
+                                        'CellularComponentQualifierTermNames',
+                                        'SubStructureQualifierIDs',
+                                        'SubStructureQualifierTermNames',
+                                        'AnatomyTermQualifierIDs',
+                                        'AnatomyTermQualifierTermNames'], join_list(','))
 
+        combined_filepath_tsv = combined_file_basepath + '.tsv'
         combined_filepath_json = combined_file_basepath + '.json'
-        with open(combined_filepath_json, 'w') as outfile:
-            contents = {'metadata': self._generate_header(self.config_info, species.keys(), 'json'),
-                        'data': sum(associations.values(), [])}
-            json.dump(contents, outfile)
-
-        for taxon_id in associations:
-            taxon_file_basepath = os.path.join(self.generated_files_folder, file_basename + '.' + taxon_id)
-            taxon_filepath_json = taxon_file_basepath + '.json'
-            with open(taxon_filepath_json, 'w') as f:
-                contents = {'metadata': self._generate_header(self.config_info, [taxon_id], 'json'),
-                            'data': associations[taxon_id]}
-                json.dump(contents, f)
+        combined_fingerprint = Manifest.fingerprint()
+        combined_json_writer = JsonFileWriter(combined_filepath_json)
+        combined_tsv_writer = TsvFileWriter(combined_filepath_tsv, fields, formatters=tsv_formatters)
+        combined_json_checker = json_validator.RecordValidator(combined_json_writer, 'expression', active=validate_flag)
+        json_checkers = {}
+        fingerprints = {}
 
+        def open_taxon_sink(taxon_id):
             logger.info(taxon_id)
-            for association in associations[taxon_id]:
-                for key in association:
-                    if isinstance(association[key], list):
-                        association[key] = ','.join(association[key])
+            fingerprints[taxon_id] = Manifest.fingerprint()
+            taxon_file_basepath = os.path.join(self.generated_files_folder, file_basename + '.' + taxon_id)
+            taxon_json_writer = JsonFileWriter(taxon_file_basepath + '.json', self._generate_header(self.config_info, [taxon_id], 'json'))
+            json_checkers[taxon_id] = json_validator.RecordValidator(taxon_json_writer, 'expression', active=validate_flag)
+            return MultiSink(taxon_json_writer,
+                             TsvFileWriter(taxon_file_basepath + '.tsv', fields, self._generate_header(self.config_info, [taxon_id], 'tsv'),
+                                           formatters=tsv_formatters),
+                             json_checkers[taxon_id],
+                             fingerprints[taxon_id])
 
-            combined_tsv_writer.writerows(associations[taxon_id])
-            taxon_filename_tsv = taxon_file_basepath + '.tsv'
-            with open(taxon_filename_tsv, 'w') as f:
-                f.write(self._generate_header(self.config_info, [taxon_id], 'tsv'))
-                tsv_writer = csv.DictWriter(f, delimiter='\t', fieldnames=fields, lineterminator="\n")
-                tsv_writer.writeheader()
-                tsv_writer.writerows(associations[taxon_id])
+        processes = int(self.config_info.config['expression_processes'])
+        species = {}
+        with PartitionedSink(open_taxon_sink, MultiSink(combined_json_writer,
+                                                        combined_tsv_writer,
+                                                        combined_json_checker,
+                                                        combined_fingerprint),
+                             max_open=int(self.config_info.config['max_open_partitions'])) as sink:
+            for chunk in transformed_chunks(iter(self.expressions), processes):
+                for association in chunk:
+                    taxon_id = association['SpeciesID']
+                    species[taxon_id] = association['Species']
+                    sink.write(taxon_id, association)
 
-        combined_expression_file.close()
+            combined_json_writer.metadata = self._generate_header(self.config_info, species.keys(), 'json')
+            combined_tsv_writer.header = self._generate_header(self.config_info, species.keys(), 'tsv')
 
         if validate_flag:
-            json_validator.JsonValidator(combined_filepath_json, 'expression').validateJSON()
             process_name = "1"
-            if upload_flag:
-                logger.info("Submitting expression files to FMS")
+            if not (upload_flag and Manifest.uploaded('EXPRESSION-ALLIANCE', 'COMBINED', combined_fingerprint)):
+                combined_json_checker.validateJSON()
+                if upload_flag:
+                    logger.info("Submitting expression files to FMS")
 
-                upload.upload_process(process_name, combined_filepath_tsv, self.generated_files_folder, 'EXPRESSION-ALLIANCE', 'COMBINED', self.config_info)
-                upload.upload_process(process_name, combined_filepath_json, self.generated_files_folder, 'EXPRESSION-ALLIANCE-JSON', 'COMBINED', self.config_info)
-            for taxon_id in associations:
+                    uploads = [upload.upload_process(process_name,
+                                                     combined_filepath_tsv,
+                                                     self.generated_files_folder,
+                                                     'EXPRESSION-ALLIANCE',
+                                                     'COMBINED',
+                                                     self.config_info),
+                               upload.upload_process(process_name,
+                                                     combined_filepath_json,
+                                                     self.generated_files_folder,
+                                                     'EXPRESSION-ALLIANCE-JSON',
+                                                     'COMBINED',
+                                                     self.config_info)]
+                    Manifest.record_upload('EXPRESSION-ALLIANCE', 'COMBINED', combined_fingerprint, uploads)
+            for taxon_id in fingerprints:
+                if upload_flag and Manifest.uploaded('EXPRESSION-ALLIANCE', taxon_id, fingerprints[taxon_id]):
+                    continue
+                uploads = []
                 for file_extension in ['json', 'tsv']:
                     filename = file_basename + "." + taxon_id + '.' + file_extension
                     datatype = "EXPRESSION-ALLIANCE"
                     if file_extension == "json":
                         datatype += "-JSON"
-                        json_validator.JsonValidator(os.path.join(self.generated_files_folder, filename), 'expression').validateJSON()
+                        json_checkers[taxon_id].validateJSON()
                     if upload_flag:
-                        upload.upload_process(process_name,
-                                              filename,
-                                              self.generated_files_folder,
-                                              datatype,
-                                              self.taxon_id_fms_subtype_map[taxon_id],
-                                              self.config_info)
\ No newline at end of file
+                        uploads.append(upload.upload_process(process_name,
+                                                             filename,
+                                                             self.generated_files_folder,
+                                                             datatype,
+                                                             self.taxon_id_fms_subtype_map[taxon_id],
+                                                             self.config_info))
+                if upload_flag:
+                    Manifest.record_upload('EXPRESSION-ALLIANCE', taxon_id, fingerprints[taxon_id], uploads)
\ No newline at end of file
@@ -1,10 +1,9 @@
 import os
 import logging
-import json
-import csv
 
 import upload
 from headers import create_header
+from writers import JsonFileWriter, TsvFileWriter, MultiSink
 from validators import json_validator
 
 logger = logging.getLogger(name=__name__)
@@ -32,31 +31,22 @@ class HumanGenesInteractingWithFileGenerator:
                   "Symbol",
                   "Name"]
 
-        processed_interactions = []
-        for interaction in self.interactions:
-            processed_interactions.append(dict(zip(fields, [interaction["GeneID"],
-                                                            interaction["Symbol"],
-                                                            interaction["Name"]])))
-
         json_filename = file_basename + ".json"
         json_filepath = os.path.join(self.generated_files_folder, json_filename)
-        with open(json_filepath, 'w') as outfile:
-            contents = {'metadata': self._generate_header(self.config_info, 'json'),
-                        'data': processed_interactions}
-            json.dump(contents, outfile)
-
         tsv_filename = file_basename + ".tsv"
         tsv_filepath = os.path.join(self.generated_files_folder, tsv_filename)
-        tsv_file = open(tsv_filepath, 'w')
-        tsv_file.write(self._generate_header(self.config_info, 'tsv'))
-
-        tsv_writer = csv.DictWriter(tsv_file, delimiter='\t', fieldnames=fields, lineterminator="\n")
-        tsv_writer.writeheader()
-        tsv_writer.writerows(processed_interactions)
-        tsv_file.close()
+        json_writer = JsonFileWriter(json_filepath, self._generate_header(self.config_info, 'json'))
+        json_checker = json_validator.RecordValidator(json_writer, 'human-genes-interacting-with', active=validate_flag)
+        with MultiSink(json_writer,
+                       TsvFileWriter(tsv_filepath, fields, self._generate_header(self.config_info, 'tsv')),
+                       json_checker) as sink:
+            for interaction in self.interactions:
+                sink.write(dict(zip(fields, [interaction["GeneID"],
+                                             interaction["Symbol"],
+                                             interaction["Name"]])))
 
         if validate_flag:
-            json_validator.JsonValidator(json_filepath, 'human-genes-interacting-with').validateJSON()
+            json_checker.validateJSON()
             if upload_flag:
                 logger.info("Submitting human genes interacting with filse to FMS")
                 process_name = "1"
@@ -1,10 +1,9 @@
 import os
 import logging
-import json
-import csv
 
 import upload
 from headers import create_header
+from writers import JsonFileWriter, TsvFileWriter, MultiSink, join_list
 from validators import json_validator
 
 logger = logging.getLogger(name=__name__)
@@ -43,48 +42,41 @@ class OrthologyFileGenerator:
                   "IsBestScore",
                   "IsBestRevScore"]
 
-        processed_orthologs = []
-        taxon_ids = set()
-        for ortholog in self.orthologs:
-            num_algorithms = ortholog["numAlgorithmMatch"] + ortholog["numAlgorithmNotMatched"]
-            taxon_ids.add(ortholog["species1TaxonID"])
-            taxon_ids.add(ortholog["species2TaxonID"])
-            processed_orthologs.append(dict(zip(fields, [ortholog["gene1ID"],
-                                                         ortholog["gene1Symbol"],
-                                                         ortholog["species1TaxonID"],
-                                                         ortholog["species1Name"],
-                                                         ortholog["gene2ID"],
-                                                         ortholog["gene2Symbol"],
-                                                         ortholog["species2TaxonID"],
-                                                         ortholog["species2Name"],
-                                                         ortholog["Algorithms"],
-                                                         str(ortholog["numAlgorithmMatch"]),
-                                                         num_algorithms,
-                                                         ortholog["best"],
-                                                         ortholog["bestRev"]])))
-
         json_filename = file_basename + ".json"
         json_filepath = os.path.join(self.generated_files_folder, json_filename)
-        with open(json_filepath, 'w') as outfile:
-            contents = {'metadata': self._generate_header(self.config_info, taxon_ids, 'json'),
-                        'data': processed_orthologs}
-            json.dump(contents, outfile)
-
-        for processed_ortholog in processed_orthologs:
-            processed_ortholog['Algorithms'] = "|".join(set(processed_ortholog['Algorithms']))
+        json_writer = JsonFileWriter(json_filepath)
 
         tsv_filename = file_basename + ".tsv"
         tsv_filepath = os.path.join(self.generated_files_folder, tsv_filename)
-        tsv_file = open(tsv_filepath, 'w')
-        tsv_file.write(self._generate_header(self.config_info, taxon_ids, 'tsv'))
+        tsv_writer = TsvFileWriter(tsv_filepath, fields, formatters={'Algorithms': join_list('|', unique=True)})
+        json_checker = json_validator.RecordValidator(json_writer, 'orthology', active=validate_flag)
+
+        taxon_ids = set()
+        with MultiSink(json_writer, tsv_writer, json_checker) as sink:
+            for batch in self.orthologs.batches(columns=True):
+                taxon_ids.update(batch["species1TaxonID"])
+                taxon_ids.update(batch["species2TaxonID"])
+                num_algorithms = [matched + not_matched for (matched, not_matched)
+                                  in zip(batch["numAlgorithmMatch"], batch["numAlgorithmNotMatched"])]
+                sink.write_batch([dict(zip(fields, row)) for row in zip(batch["gene1ID"],
+                                                                        batch["gene1Symbol"],
+                                                                        batch["species1TaxonID"],
+                                                                        batch["species1Name"],
+                                                                        batch["gene2ID"],
+                                                                        batch["gene2Symbol"],
+                                                                        batch["species2TaxonID"],
+                                                                        batch["species2Name"],
+                                                                        batch["Algorithms"],
+                                                                        map(str, batch["numAlgorithmMatch"]),
+                                                                        num_algorithms,
+                                                                        batch["best"],
+                                                                        batch["bestRev"])])
 
-        tsv_writer = csv.DictWriter(tsv_file, delimiter='\t', fieldnames=fields, lineterminator="\n")
-        tsv_writer.writeheader()
-        tsv_writer.writerows(processed_orthologs)
-        tsv_file.close()
+            json_writer.metadata = self._generate_header(self.config_info, taxon_ids, 'json')
+            tsv_writer.header = self._generate_header(self.config_info, taxon_ids, 'tsv')
 
         if validate_flag:
-            json_validator.JsonValidator(json_filepath, 'orthology').validateJSON()
+            json_checker.validateJSON()
             if upload_flag:
                 logger.info("Submitting orthology filse to FMS")
                 process_name = "1"
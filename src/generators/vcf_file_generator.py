@@ -1,11 +1,10 @@
 import os
-import time
 import sys
 from collections import defaultdict, OrderedDict
-from functools import partial
-from operator import itemgetter
-from common import run_command
+from contextlib import nullcontext
+from common import run_timestamp
 from validators import vcf_validator
+from writers import BgzfWriter, ExternalSorter, TabixIndex
 import logging
 import upload
 
@@ -20,6 +19,8 @@ class VcfFileGenerator:
 
     col_headers = ('CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO')
 
+    sort_buffer_size = 200000
+
     def __init__(self, variants, generated_files_folder, config_info):
         self.variants = variants
         self.config_info = config_info
@@ -33,8 +34,8 @@ class VcfFileGenerator:
             variant['genomicVariantSequence'] = padded_base + variant['genomicVariantSequence']
 
     @classmethod
-    def _write_vcf_header(cls, vcf_file, assembly, contigs, species, config_info):
-        dt = time.strftime("%Y%m%d", time.gmtime())
+    def _vcf_header(cls, assembly, contigs, species, config_info):
+        dt = run_timestamp("%Y%m%d")
         my_path = os.path.abspath(os.path.dirname(__file__))
         vcf_header_path = os.path.join(my_path, '../headers/vcf_header_template.txt')
         header = open(vcf_header_path).read().format(datetime=dt,
@@ -42,9 +43,7 @@ class VcfFileGenerator:
         for contig in contigs:
             header = header + "##contig=<ID=" + contig + ",assembly=" + assembly + ",species=\"" + species + "\">\n"
 
-        vcf_file.write(header)
-        vcf_file.write('#' + '\t'.join(cls.col_headers))
-        vcf_file.write('\n')
+        return header + '#' + '\t'.join(cls.col_headers) + '\n'
 
     @classmethod
     def _variant_value_for_file(cls, variant, data_key, transform=None):
@@ -56,7 +55,7 @@ class VcfFileGenerator:
         return transform(value)
 
     @classmethod
-    def _add_variant_to_vcf_file(cls, vcf_file, variant):
+    def _vcf_line(cls, variant):
         info_map = OrderedDict()
         info_map['hgvs_nomenclature'] = cls._variant_value_for_file(variant, 'hgvsNomenclature')
 
@@ -163,25 +162,48 @@ class VcfFileGenerator:
                             if v)
         else:
             info = cls.empty_value_marker
-        vcf_file.write('\t'.join([variant['chromosome'],
-                                  str(variant['POS']),
-                                  info_map['hgvs_nomenclature'],
-                                  variant['genomicReferenceSequence'],
-                                  variant['genomicVariantSequence'],
-                                  '.',
-                                  '.',
-                                  info]))
-        vcf_file.write('\n')
-
-    def _consume_data_source(self):
-        assembly_chr_variants = defaultdict(lambda: defaultdict(list))
+        return '\t'.join([variant['chromosome'],
+                          str(variant['POS']),
+                          info_map['hgvs_nomenclature'],
+                          variant['genomicReferenceSequence'],
+                          variant['genomicVariantSequence'],
+                          '.',
+                          '.',
+                          info]) + '\n'
+
+    @staticmethod
+    def _vcf_line_sort_key(line):
+        chromosome, position, _ = line.split('\t', 2)
+        return (chromosome, int(position))
+
+    def _consume_data_source(self, skip_chromosomes):
+        """Format every variant as a VCF line and sort the lines of each assembly.
+
+        Only the formatted lines are kept, and they are spilled to sorted runs
+        on disk once a buffer fills up, so memory use does not grow with the
+        size of the assembly.
+        """
+        assembly_sorters = {}
+        assembly_contigs = defaultdict(set)
         assembly_species = {}
+        skipped_chromosomes = set()
         for variant in self.variants:
             assembly = variant['assembly'].replace('_', '')
             chromosome = variant['chromosome']
-            assembly_chr_variants[assembly][chromosome].append(variant)
             assembly_species[assembly] = variant['species']
-        return (assembly_chr_variants, assembly_species)
+            if assembly not in assembly_sorters:
+                assembly_sorters[assembly] = ExternalSorter(self._vcf_line_sort_key,
+                                                            buffer_size=self.sort_buffer_size,
+                                                            tmp_dir=self.generated_files_folder)
+            if chromosome in skip_chromosomes:
+                if chromosome not in skipped_chromosomes:
+                    logger.info('Skipping VCF file generation for chromosome %r', chromosome)
+                    skipped_chromosomes.add(chromosome)
+                continue
+            assembly_contigs[assembly].add(chromosome)
+            if self._adjust_variant(variant) is not None:
+                assembly_sorters[assembly].add(self._vcf_line(variant))
+        return (assembly_sorters, assembly_contigs, assembly_species)
 
     def _find_replace(self, string, iupac_codes):
         # is the item in the dict?
@@ -239,47 +261,47 @@ class VcfFileGenerator:
             return None
         return variant
 
-    def generate_files(self, skip_chromosomes=(), upload_flag=False, validate_flag=False):
-        (assembly_chr_variants, assembly_species) = self._consume_data_source()
-        for (assembly, chromo_variants) in assembly_chr_variants.items():
+    def _write_vcf_files(self, filepath, header, lines, write_uncompressed):
+        """Write the bgzipped VCF and its tabix index in one pass over the sorted lines.
+
+        The index is built from the chromosome, position and reference allele of
+        each line as it is compressed, so the file never has to be re-read.
+        """
+        index = TabixIndex('vcf')
+        threads = int(self.config_info.config['compression_threads'])
+        with BgzfWriter(filepath + '.gz', threads=threads) as bgzf_file, \
+                (open(filepath, 'w') if write_uncompressed else nullcontext()) as vcf_file:
+            bgzf_file.write(header)
+            if vcf_file:
+                vcf_file.write(header)
+            for line in lines:
+                start_position = bgzf_file.tell()
+                bgzf_file.write(line)
+                if vcf_file:
+                    vcf_file.write(line)
+                (chromosome, position, _, reference) = line.split('\t', 4)[:4]
+                begin = int(position) - 1
+                index.add(chromosome, begin, begin + len(reference), start_position, bgzf_file.tell())
+        index.write(filepath + '.gz.tbi', bgzf_file)
+
+    def generate_files(self, skip_chromosomes=(), upload_flag=False, validate_flag=False, write_uncompressed=True):
+        (assembly_sorters, assembly_contigs, assembly_species) = self._consume_data_source(skip_chromosomes)
+        for (assembly, sorter) in assembly_sorters.items():
             filename = assembly + '-' + self.config_info.config['RELEASE_VERSION'] + '.vcf'
             filepath = os.path.join(self.generated_files_folder, filename)
             logger.info('Generating VCF File for assembly %r', assembly)
-            with open(filepath, 'w') as vcf_file:
-                contigs = set()
-                for (chromosome, variants) in sorted(chromo_variants.items(), key=itemgetter(0)):
-                    if chromosome not in skip_chromosomes:
-                        contigs.add(chromosome)
-                self._write_vcf_header(vcf_file, assembly, contigs,
-                                       assembly_species[assembly],
-                                       self.config_info)
-                for (chromosome, variants) in sorted(chromo_variants.items(), key=itemgetter(0)):
-                    if chromosome in skip_chromosomes:
-                        logger.info('Skipping VCF file generation for chromosome %r', chromosome)
-                        continue
-                    adjust_varient = partial(self._adjust_variant)
-                    adjusted_variants = filter(None, map(adjust_varient, variants))
-                    for variant in sorted(adjusted_variants, key=itemgetter('POS')):
-                        self._add_variant_to_vcf_file(vcf_file, variant)
-            stdout, stderr, return_code = run_command('bgzip -c ' + filepath + ' > ' + filepath + '.gz')
-            if return_code == 0:
-                logger.info(filepath + ' compressed successfully')
-            else:
-                logger.error(filepath + ' could not be compressed')
-                exit(-1)
-
-            command = 'tabix -p vcf ' + filepath + '.gz'
-            stdout, stderr, return_code = run_command(command)
-            if return_code == 0:
-                logger.info('Index file created: ' + filepath + '.gz.tbi')
-            else:
-                logger.error('Could not create index file: ' + command)
-                exit(-1)
+            header = self._vcf_header(assembly, sorted(assembly_contigs[assembly]),
+                                      assembly_species[assembly],
+                                      self.config_info)
+            with sorter:
+                self._write_vcf_files(filepath, header, sorter, write_uncompressed)
+            logger.info(filepath + '.gz compressed successfully')
+            logger.info('Index file created: ' + filepath + '.gz.tbi')
 
             if validate_flag:
                 process_name = "1"
                 filepath = os.path.join(self.generated_files_folder, filename)
-                validator = vcf_validator.VcfValidator(filepath)
+                validator = vcf_validator.VcfValidator(filepath + '.gz')
                 validator.validate_vcf()
                 if upload_flag:
                     logger.info("Submitting to FMS")
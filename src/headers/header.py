@@ -1,7 +1,8 @@
 import os
 import logging
-from datetime import datetime
+import functools
 from string import Template
+from common import run_timestamp
 from common import get_ordered_species_dict
 from common import ordered_taxon_species_map_from_data_dictionary
 from common import get_taxon_id_from_assembly
@@ -14,6 +15,13 @@ class HeaderTemplate(Template):
     delimiter = '%'
 
 
+@functools.lru_cache(maxsize=None)
+def load_header_template(template_file):
+    my_path = os.path.abspath(os.path.dirname(__file__))
+    with open(os.path.join(my_path, template_file)) as template:
+        return HeaderTemplate(template.read())
+
+
 def create_header(file_type, database_version, data_format,
                   config_info='',
                   readme='',
@@ -45,7 +53,7 @@ def create_header(file_type, database_version, data_format,
     if stringency_filter != '':
         stringency_filter = '\n# Orthology Filter: ' + stringency_filter
 
-    gen_time = datetime.utcnow().strftime("%Y-%m-%d %H:%M")
+    gen_time = run_timestamp("%Y-%m-%d %H:%M")
     metadata = {'filetype': file_type,
                 'databaseVersion': database_version,
                 'sourceURL': source_url,
@@ -66,15 +74,11 @@ def create_header(file_type, database_version, data_format,
         metadata['taxonIds'] = ', '.join(ordered_taxon_species_map.keys())
         metadata['species'] = ', '.join(ordered_taxon_species_map.values())
 
-        my_path = os.path.abspath(os.path.dirname(__file__))
-
         if file_type == 'Allele GFF':
             template_file = 'allele_gff_file_header.txt'
         else:
             template_file = 'tsv_header_template.txt'
 
-        file_header_template = HeaderTemplate(open(os.path.join(my_path, template_file)).read())
-
-        return file_header_template.substitute(metadata)
+        return load_header_template(template_file).substitute(metadata)
     else:
         raise ValueError("Wrong data_format: " + "' - must be set to 'json' or 'tsv'")
@@ -0,0 +1,120 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(name=__name__)
+
+
+class Fingerprint:
+    """Record count and rolling sha256 of the records written to one partition.
+
+    It has the writer interface, so it can be handed to a MultiSink next to
+    the file writers. `normalize`, when given, maps each record to what is
+    hashed, so values that differ from run to run can be left out. Inactive
+    fingerprints ignore their records.
+    """
+
+    def __init__(self, active=True, normalize=None):
+        self.active = active
+        self.normalize = normalize
+        self.count = 0
+        self._hash = hashlib.sha256()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def write(self, record):
+        if self.active:
+            if self.normalize is not None:
+                record = self.normalize(record)
+            self._hash.update(json.dumps(record, sort_keys=True, default=str).encode('utf-8'))
+            self._hash.update(b'\n')
+            self.count += 1
+
+    def write_batch(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        pass
+
+    def value(self):
+        return {'count': self.count, 'sha256': self._hash.hexdigest()}
+
+
+class Manifest:
+    """Fingerprints of the partitions (species or COMBINED) last uploaded to FMS.
+
+    Incremental runs set `path`, normally manifest.json in the generated files
+    folder, and `release`. A partition whose records fingerprint the same as
+    at its last upload for the same release is neither validated nor uploaded
+    again; the manifest of an earlier release is ignored and replaced. Only
+    the variant allele, disease and expression files are fingerprinted; VCF
+    and allele GFF files are always uploaded.
+    """
+
+    path = None
+    release = None
+
+    _entries = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def fingerprint(cls, normalize=None):
+        return Fingerprint(active=cls.path is not None, normalize=normalize)
+
+    @classmethod
+    def _load(cls):
+        if cls._entries is None:
+            cls._entries = {}
+            if os.path.exists(cls.path):
+                with open(cls.path, 'r') as manifest_file:
+                    manifest = json.load(manifest_file)
+                if manifest.get('release') == cls.release:
+                    cls._entries = manifest['partitions']
+                else:
+                    logger.info('Ignoring %s, written for release %s', cls.path, manifest.get('release'))
+        return cls._entries
+
+    @classmethod
+    def uploaded(cls, file_type, partition, fingerprint):
+        """True if the partition was last uploaded with this fingerprint."""
+        if cls.path is None:
+            return False
+        with cls._lock:
+            unchanged = cls._load().get(file_type, {}).get(partition) == fingerprint.value()
+        if unchanged:
+            logger.info('%s %s unchanged since its last upload (%d records), skipping it',
+                        file_type, partition, fingerprint.count)
+        return unchanged
+
+    @classmethod
+    def record_upload(cls, file_type, partition, fingerprint, uploads=()):
+        """Record the partition's fingerprint once all of its `uploads` (futures) have succeeded."""
+        if cls.path is None:
+            return
+        uploads = list(uploads)
+        if uploads:
+            remaining = [len(uploads)]
+
+            def upload_done(future):
+                with cls._lock:
+                    remaining[0] -= 1
+                    finished = remaining[0] == 0
+                if finished and not any(upload.exception() for upload in uploads):
+                    cls.record_upload(file_type, partition, fingerprint)
+
+            for upload in uploads:
+                upload.add_done_callback(upload_done)
+            return
+        with cls._lock:
+            cls._load().setdefault(file_type, {})[partition] = fingerprint.value()
+            tmp_path = cls.path + '.tmp'
+            with open(tmp_path, 'w') as manifest_file:
+                json.dump({'release': cls.release, 'partitions': cls._entries}, manifest_file, indent=4, sort_keys=True)
+            os.replace(tmp_path, cls.path)
@@ -1 +1,2 @@
 from .upload import upload_process
+from .upload import UploadManager
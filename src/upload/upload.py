@@ -1,40 +1,150 @@
 # Functions for use in downloading files.
 import os
+import time
 
 import logging
+import threading
 import requests
-# from requests_toolbelt.utils import dump
-from retry import retry
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
+from retry.api import retry_call
 
 logger = logging.getLogger(__name__)
 
 
-def upload_file(worker, filename, save_path, upload_file_prefix, config_info):
-    with open(os.path.join(save_path, filename), 'rb') as fp:
-        file_to_upload = {upload_file_prefix: fp}
-        logger.info(file_to_upload)
+class UploadManager:
+    """Upload files to FMS from a pool of threads sharing one HTTP session.
+
+    Every generator submits through the same manager, so no more than
+    `max_workers` uploads run at once however many file types are being
+    generated. Submitting does not wait for the upload: generators carry on
+    with their next file while earlier ones are sent, and ``shutdown()``
+    drains the queue at the end of the run. Failed requests are retried with
+    exponential backoff plus jitter, and ``report()`` logs the latency and
+    throughput of each file.
+    """
+
+    instance = None
+    progress_interval = 30
+
+    _lock = threading.Lock()
+
+    def __init__(self, config_info, max_workers=4, tries=5, delay=5, max_delay=300):
+        self.config_info = config_info
+        self.tries = tries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         if config_info.config['API_KEY']:
-            headers = {
-                'Authorization': 'Bearer {}'.format(config_info.config['API_KEY'])
-            }
-        else:
-            headers = {}
-        logger.debug('{}: Attempting upload of data file: {}'.format(worker, os.path.join(save_path, filename)))
-        logger.debug('{}: Attempting upload with header: {}'.format(worker, headers))
-        logger.info("{}: Uploading data to {}) ...".format(worker, config_info.config['FMS_API_URL'] + '/api/data/submit/'))
-        response = requests.post(config_info.config['FMS_API_URL'] + '/api/data/submit', files=file_to_upload, headers=headers)
-        logger.info(response.text)
+            self.session.headers['Authorization'] = 'Bearer {}'.format(config_info.config['API_KEY'])
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload')
+        self.stats = []
+        self.failures = []
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, config_info):
+        """Return the run's manager, creating it from `config_info` on first use."""
+        with cls._lock:
+            if cls.instance is None:
+                cls.instance = cls(config_info,
+                                   max_workers=int(config_info.config['upload_threads']),
+                                   tries=int(config_info.config['UPLOAD_TRIES']),
+                                   delay=int(config_info.config['UPLOAD_RETRY_DELAY']))
+            return cls.instance
+
+    @classmethod
+    def shutdown(cls):
+        """Wait for queued uploads, report on them and close the session.
+
+        Returns the paths of the files that could not be uploaded.
+        """
+        with cls._lock:
+            manager, cls.instance = cls.instance, None
+        if manager is None:
+            return []
+        logger.info("Waiting for queued uploads to finish")
+        manager.executor.shutdown(wait=True)
+        manager.session.close()
+        manager.report()
+        return manager.failures
+
+    def submit(self, worker, filename, save_path, data_type, data_sub_type):
+        return self.executor.submit(self._upload, worker, filename, save_path, data_type, data_sub_type)
+
+    def _upload(self, worker, filename, save_path, data_type, data_sub_type):
+        upload_file_prefix = '{}_{}_{}'.format(self.config_info.config['RELEASE_VERSION'], data_type, data_sub_type)
+        filepath = os.path.join(save_path, filename)
+        attempts = []
+        start_time = time.time()
         try:
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            raise(e)
+            retry_call(self._post,
+                       fargs=[worker, filepath, upload_file_prefix, attempts],
+                       exceptions=requests.exceptions.RequestException,
+                       tries=self.tries,
+                       delay=self.delay,
+                       max_delay=self.max_delay,
+                       backoff=2,
+                       jitter=(0, self.delay),
+                       logger=logger)
+        except Exception:
+            logger.exception("Upload of %s failed", filepath)
+            with self._stats_lock:
+                self.failures.append(filepath)
+            raise
+        with self._stats_lock:
+            self.stats.append((filepath, os.path.getsize(filepath), start_time, time.time(), len(attempts)))
 
+    def _progress_callback(self, filepath):
+        """Return a MultipartEncoderMonitor callback logging progress every `progress_interval` seconds."""
+        start_time = last_time = time.time()
 
-@retry(tries=5, delay=5, logger=logger)
-def upload_process(worker, filename, save_path, data_type, data_sub_type, config_info):
+        def callback(monitor):
+            nonlocal last_time
+            now = time.time()
+            if now - last_time >= self.progress_interval:
+                last_time = now
+                logger.info("Uploading %s: %.1f of %.1f MB (%.2f MB/s)",
+                            os.path.basename(filepath), monitor.bytes_read / 1e6, monitor.len / 1e6,
+                            monitor.bytes_read / 1e6 / max(now - start_time, 1e-6))
+
+        return callback
 
-    upload_file_prefix = '{}_{}_{}'.format(config_info.config['RELEASE_VERSION'], data_type, data_sub_type)
+    def _post(self, worker, filepath, upload_file_prefix, attempts):
+        attempts.append(time.time())
+        with open(filepath, 'rb') as fp:
+            # Streams the multipart body from the file instead of building it in memory
+            encoder = MultipartEncoder(fields={upload_file_prefix: (os.path.basename(filepath), fp)})
+            monitor = MultipartEncoderMonitor(encoder, self._progress_callback(filepath))
+            logger.info({upload_file_prefix: fp})
+            logger.debug('{}: Attempting upload of data file: {}'.format(worker, filepath))
+            logger.info("{}: Uploading data to {}) ...".format(worker, self.config_info.config['FMS_API_URL'] + '/api/data/submit/'))
+            response = self.session.post(self.config_info.config['FMS_API_URL'] + '/api/data/submit',
+                                         data=monitor,
+                                         headers={'Content-Type': monitor.content_type})
+            logger.info(response.text)
+            response.raise_for_status()
+
+    def report(self):
+        for (filepath, size, start, end, attempts) in sorted(self.stats, key=lambda stat: stat[2] - stat[3]):
+            elapsed = end - start
+            logger.info("Uploaded %s: %.1f MB in %.1fs (%.2f MB/s, %d attempt%s)",
+                        os.path.basename(filepath), size / 1e6, elapsed, size / 1e6 / max(elapsed, 1e-6),
+                        attempts, '' if attempts == 1 else 's')
+        if self.stats:
+            total_bytes = sum(size for (_, size, _, _, _) in self.stats)
+            wall_time = max(end for (_, _, _, end, _) in self.stats) - min(start for (_, _, start, _, _) in self.stats)
+            logger.info("Uploaded %d files, %.1f MB in %.1fs (%.2f MB/s)",
+                        len(self.stats), total_bytes / 1e6, wall_time, total_bytes / 1e6 / max(wall_time, 1e-6))
+        if self.failures:
+            logger.error("Failed to upload %d files: %s", len(self.failures), ', '.join(self.failures))
 
+
+def upload_process(worker, filename, save_path, data_type, data_sub_type, config_info):
     # Attempt to grab MD5 for the latest version of the file.
     logger.info(config_info.config['FMS_API_URL'] + '/api/datafile/by/{}/{}?latest=true'.format(data_type, data_sub_type))
-    upload_file(worker, filename, save_path, upload_file_prefix, config_info)
+    return UploadManager.get(config_info).submit(worker, filename, save_path, data_type, data_sub_type)
@@ -1,2 +1,3 @@
 from .vcf_validator import VcfValidator
 from .json_validator import JsonValidator
+from .json_validator import RecordValidator
@@ -1,35 +1,215 @@
 import os
-import logging
+import copy
 import json
+import logging
+import threading
 
-from jsonschema import validate
-from jsonschema import ValidationError
+from jsonschema import RefResolver
 from jsonschema import SchemaError
+from jsonschema.validators import validator_for
 
 logger = logging.getLogger(name=__name__)
 
 
+class JsonRecordReader:
+    """Read a ``{..., "data": [...]}`` document without loading the data array.
+
+    ``records()`` yields the items of "data" one at a time; once it is
+    exhausted, ``document`` holds every other top-level member.
+    """
+
+    chunk_size = 1024 * 1024
+    number_delimiters = ',]} \t\r\n'
+
+    def __init__(self, json_file):
+        self.json_file = json_file
+        self.document = {}
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+
+    def _fill(self):
+        chunk = self.json_file.read(self.chunk_size)
+        if not chunk:
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _next_char(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('unexpected end of file')
+
+    def _expect(self, chars):
+        char = self._next_char()
+        if char not in chars:
+            raise ValueError('expected %r at offset %d, found %r' % (chars, self._pos, char))
+        self._pos += 1
+        return char
+
+    def _value(self):
+        self._next_char()
+        while True:
+            try:
+                (value, end) = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number cut by the end of the buffer still decodes ("6." as 6),
+                # so it is only complete once a delimiter or the end of the file follows
+                if (isinstance(value, bool) or not isinstance(value, (int, float))
+                        or (end < len(self._buffer) and self._buffer[end] in self.number_delimiters)
+                        or not self._fill()):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    def records(self):
+        self._expect('{')
+        if self._next_char() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == 'data' and self._next_char() == '[':
+                self.document[key] = []
+                self._pos += 1
+                if self._next_char() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self.document[key] = self._value()
+            if self._expect(',}') == '}':
+                return
+
+
+class RecordValidator:
+    """Validate the records handed to a JsonFileWriter as they are written.
+
+    It has the writer interface, so it sits in the same MultiSink as the JSON
+    writer and checks each record while it is still in memory; the metadata
+    is checked when the sink is closed. ``validateJSON()`` reports the errors
+    and, with `deep`, also re-reads the written file with JsonValidator.
+    Inactive validators ignore their records.
+    """
+
+    deep = False
+    max_errors = 20
+
+    def __init__(self, json_writer, schema, active=True):
+        self.json_writer = json_writer
+        self.schema = schema
+        self.active = active
+        self.count = 0
+        self.error_count = 0
+        self.errors = []
+        self.schema_filepath = os.path.join("./schemas/", schema) + '.schema'
+        if active:
+            (self._document_validator, self._item_validator) = JsonValidator.get_validators(self.schema_filepath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def _add_errors(self, errors, path):
+        for error in errors:
+            self.error_count += 1
+            if len(self.errors) < self.max_errors:
+                self.errors.append((path + list(error.absolute_path), error))
+
+    def write(self, record):
+        if self.active:
+            self._add_errors(self._item_validator.iter_errors(record), ['data', self.count])
+            self.count += 1
+
+    def write_batch(self, records):
+        for record in records:
+            self.write(record)
+
+    def validate_document(self, document):
+        """Check the top-level members of the document, with an empty data array."""
+        self._add_errors(self._document_validator.iter_errors(document), [])
+
+    def close(self):
+        if self.active:
+            self.validate_document({'metadata': self.json_writer.metadata, 'data': []})
+
+    def report(self, filepath):
+        if self.error_count:
+            for (path, error) in self.errors:
+                logger.error("%s: %s", '/'.join(str(part) for part in path), error.message)
+                logger.error("schema path: %s", '/'.join(str(part) for part in error.absolute_schema_path))
+            logger.error("%d validation errors in %s against '%s'", self.error_count, filepath, self.schema_filepath)
+            exit(-1)
+        logger.info("successfully validated against '%s'" % self.schema_filepath)
+
+    def validateJSON(self):
+        logger.info("validating " + self.json_writer.filepath + " records as written")
+        self.report(self.json_writer.filepath)
+        if self.deep:
+            JsonValidator(self.json_writer.filepath, self.schema).validateJSON()
+
+
 class JsonValidator:
+    """Validate a generated JSON file against one of the schemas in ./schemas/.
+
+    Records of the "data" array are parsed and validated one at a time with
+    a validator for the item subschema, compiled once per schema and shared
+    between instances. Up to `RecordValidator.max_errors` errors are reported
+    before exiting.
+    """
+
+    _validators = {}
+    _validators_lock = threading.Lock()
+
     def __init__(self, filepath, schema):
         self.filepath = filepath
         self.schema = schema
 
-    def validateJSON(self):
-        logger.info("validating " + self.filepath)
-        with open(self.filepath, "r") as jsonFile:
-            schema_filepath = os.path.join("./schemas/", self.schema) + '.schema'
-            with open(schema_filepath, "r") as schemaFile:
+    @classmethod
+    def get_validators(cls, schema_filepath):
+        """Return the (document, item) validators for a schema file, compiled once."""
+        with cls._validators_lock:
+            if schema_filepath not in cls._validators:
+                with open(schema_filepath, "r") as schemaFile:
+                    schema = json.load(schemaFile)
+                validator_class = validator_for(schema)
                 try:
-                    validate(json.load(jsonFile), json.load(schemaFile))
-                    logger.info("successfully validated against '%s'" % schema_filepath)
+                    validator_class.check_schema(schema)
                 except SchemaError as e:
                     logger.error(e)
                     logger.error("There is an error with the schema")
                     exit(-1)
-                except ValidationError as e:
-                    logger.error(e)
-                    logger.error("---------")
-                    logger.error(e.absolute_path)
-                    logger.error("---------")
-                    logger.error(e.absolute_schema_path)
-                    exit(-1)
+                resolver = RefResolver.from_schema(schema)
+                document_schema = copy.deepcopy(schema)
+                item_schema = document_schema['properties']['data'].pop('items', {})
+                cls._validators[schema_filepath] = (validator_class(document_schema, resolver=resolver),
+                                                    validator_class(item_schema, resolver=resolver))
+            return cls._validators[schema_filepath]
+
+    def validateJSON(self):
+        logger.info("validating " + self.filepath)
+        checker = RecordValidator(None, self.schema)
+        with open(self.filepath, "r") as jsonFile:
+            reader = JsonRecordReader(jsonFile)
+            try:
+                for record in reader.records():
+                    checker.write(record)
+            except ValueError as e:
+                logger.error(e)
+                logger.error("%s is not valid JSON" % self.filepath)
+                exit(-1)
+            checker.validate_document(reader.document)
+        checker.report(self.filepath)
@@ -1,9 +1,7 @@
+import gzip
 import ntpath
+import hashlib
 import logging
-import collections
-from operator import itemgetter
-from collections import OrderedDict
-from itertools import groupby
 from common import run_command
 
 logger = logging.getLogger(name=__name__)
@@ -35,80 +33,92 @@ EXAMPLE_CASES = {
 
 
 class VcfValidator:
+    """Check a VCF (plain or bgzipped) in a single streaming pass.
+
+    Records are sorted by chromosome then position, have unique IDs and
+    match the EXAMPLE_CASES of their assembly. Only the current record, the
+    pending examples and a 64 bit hash per ID are held in memory.
+    """
 
     def __init__(self, filepath):
         self.filepath = filepath
         self.filename = ntpath.basename(filepath)
         self.assembly = self.filename.split('-')[0]
 
-    def parse_vcf_file(self, path):
-        """
+    def _open(self):
+        if self.filepath.endswith('.gz'):
+            return gzip.open(self.filepath, 'rt')
+        return open(self.filepath, 'rt')
+
+    @staticmethod
+    def _id_hash(variant_id):
+        return int.from_bytes(hashlib.blake2b(variant_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+    def check_example(self, example, vcf_record):
+        for key in example.keys():
+            if example[key] != vcf_record[key]:
+                logger.error('Mismatch between example and parsed VCF record')
+                logger.error("key mismatch: " + key)
+                logger.error("example value: " + example[key])
+                logger.error("VCF record value: " + vcf_record[key])
+                exit(-1)
 
-        :param path:
-        :return:
-        """
+    def validate_vcf(self):
+        logger.info("Validating VCF: %s" % self.filename)
+
+        examples = dict((example['ID'], example) for example in EXAMPLE_CASES.get(self.assembly, []))
+        if not examples:
+            logger.info('No examples for ' + self.filename + ', skipping ...')
 
-        data = []
         headers = []
-        with open(path, 'rt') as fp:
+        seen_ids = set()
+        duplicates = []
+        duplicate_count = 0
+        previous_chromosome = None
+        previous_position = None
+        with self._open() as fp:
             for line in fp:
                 if line.startswith('##'):
                     continue
                 if line.startswith('#'):
-                    cols = line[1:].split('\t')
-                    headers.extend(cols)
+                    headers = line[1:].rstrip('\n').split('\t')
+                    id_column = headers.index('ID')
                     continue
-                else:
-                    cols = line.split('\t')
-                data.append(OrderedDict(zip(headers, cols)))
-        return data
+                cols = line.rstrip('\n').split('\t')
 
-    def check_examples(self, parsed_vcf):
-        examples = EXAMPLE_CASES.get(self.assembly)
-        if not examples:
-            logger.info('No examples for ' + self.filename + ', skipping ...')
-        else:
-            logger.info('Checking against examples')
-            found = False
-            for example in examples:
-                for vcf_record in parsed_vcf:
-                    if vcf_record['ID'] == example['ID']:
-                        found = True
-                        for key in example.keys():
-                            if example[key] != vcf_record[key]:
-                                logger.error('Mismatch between example and parsed VCF record')
-                                logger.error("key mismatch: " + key)
-                                logger.error("example value: " + example[key])
-                                logger.error("VCF record value: " + vcf_record[key])
-                                exit(-1)
-                if not found:
-                    logger.error('No matching VCF data found for example with id: ' + example['ID'])
+                chromosome = cols[0]
+                position = int(cols[1])
+                if previous_chromosome is not None and chromosome < previous_chromosome:
+                    logger.error('Chromosomes not alphabetically sorted')
+                    exit(-1)
+                if chromosome == previous_chromosome and position < previous_position:
+                    logger.error('Positions are not sorted in correct order')
                     exit(-1)
+                previous_chromosome = chromosome
+                previous_position = position
+
+                variant_id = cols[id_column]
+                id_hash = self._id_hash(variant_id)
+                if id_hash in seen_ids:
+                    duplicate_count += 1
+                    if len(duplicates) < 20:
+                        duplicates.append(variant_id)
+                else:
+                    seen_ids.add(id_hash)
 
-    def check_sorted_by_chromosome_and_position(self, parsed_vcf):
-        select_chromosome = itemgetter('CHROM')
-        chromosomes = list(map(select_chromosome, parsed_vcf))
-        assert chromosomes == sorted(chromosomes), 'Chromosomes not alphabetically sorted'
-        for (chromo, recs) in groupby(parsed_vcf, select_chromosome):
-            row = list(recs)
-            positions = list(int(col['POS']) for col in row)
-            if positions != sorted(positions):
-                logger.error('Positions are not sorted in correct order')
-                exit(-1)
+                example = examples.pop(variant_id, None)
+                if example is not None:
+                    self.check_example(example, dict(zip(headers, cols)))
 
         logger.info('Sorted by chromosome and position')
-
-    def check_duplicate_entries(self, parsed_vcf):
-        all_entries = []
-        for variant in parsed_vcf:
-            all_entries.append(variant['ID'])
-
-        if len(all_entries) == len(set(all_entries)):
-            logger.info("No duplicate enteries")
-        else:
-            logger.error("At least one Duplicate entery")
-            logger.error([item for item, count in collections.Counter(all_entries).items() if count > 1])
+        if examples:
+            logger.error('No matching VCF data found for example with id: ' + next(iter(examples)))
+            exit(-1)
+        if duplicate_count:
+            logger.error("%d Duplicate enteries, including:" % duplicate_count)
+            logger.error(duplicates)
             exit(-1)
+        logger.info("No duplicate enteries")
 
     def run_vcf_validator_cmd(filepath):
         stdout, stderr, return_code = run_command('vcf-validator ' + filepath)
@@ -117,13 +127,3 @@ class VcfValidator:
         if return_code != 0:
             logger.error("vcf_validate caught error in file")
             exit(-1)
-
-
-    def validate_vcf(self):
-        logger.info("Validating VCF: %s" % self.filename)
-
-        parsed_vcf = self.parse_vcf_file(self.filepath)
-
-        self.check_examples(parsed_vcf)
-        self.check_sorted_by_chromosome_and_position(parsed_vcf)
-        self.check_duplicate_entries(parsed_vcf)
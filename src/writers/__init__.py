@@ -0,0 +1,7 @@
+from .json_writer import JsonFileWriter
+from .tsv_writer import TsvFileWriter, join_list
+from .multi_sink import MultiSink
+from .partitioned_sink import PartitionedSink
+from .external_sort import ExternalSorter
+from .bgzf_writer import BgzfWriter
+from .tabix_index import TabixIndex
@@ -0,0 +1,85 @@
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Largest amount of uncompressed data htslib puts in one block.
+BLOCK_SIZE = 0xff00
+
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def compress_block(data, compresslevel=6):
+    """Return `data` as one complete BGZF block (gzip member with a BC extra field)."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    return (struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, len(cdata) + 25)
+            + cdata
+            + struct.pack('<2I', zlib.crc32(data), len(data)))
+
+
+class BgzfWriter:
+    """Write a BGZF (blocked gzip) file directly, as ``bgzip`` would.
+
+    With `threads` > 1 full blocks are batched and compressed on a thread pool
+    (zlib releases the GIL) and written back in order. Because the compressed
+    size of a pending block is not known yet, `tell` returns a position of
+    (block number, offset in block); `virtual_offset` turns it into the BGZF
+    virtual file offset once the file has been closed.
+    """
+
+    def __init__(self, filepath, threads=1, compresslevel=6):
+        self.filepath = filepath
+        self.compresslevel = compresslevel
+        self.block_offsets = []
+        self._file = open(filepath, 'wb')
+        self._buffer = bytearray()
+        self._pending = []
+        self._batch_size = 4 * threads
+        self._executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def tell(self):
+        return (len(self.block_offsets) + len(self._pending), len(self._buffer))
+
+    def virtual_offset(self, position):
+        (block, within_block) = position
+        if block == len(self.block_offsets):
+            return self._file_end << 16 | within_block
+        return self.block_offsets[block] << 16 | within_block
+
+    def write(self, data):
+        self._buffer += data.encode() if isinstance(data, str) else data
+        while len(self._buffer) >= BLOCK_SIZE:
+            self._pending.append(bytes(self._buffer[:BLOCK_SIZE]))
+            del self._buffer[:BLOCK_SIZE]
+            if len(self._pending) >= self._batch_size:
+                self._write_pending()
+
+    def _write_pending(self):
+        if self._executor is None:
+            blocks = (compress_block(data, self.compresslevel) for data in self._pending)
+        else:
+            blocks = self._executor.map(compress_block, self._pending, [self.compresslevel] * len(self._pending))
+        for block in blocks:
+            self.block_offsets.append(self._file.tell())
+            self._file.write(block)
+        self._pending = []
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._pending.append(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._write_pending()
+        self._file_end = self._file.tell()
+        self._file.write(EOF_BLOCK)
+        self._file.close()
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,50 @@
+import heapq
+import tempfile
+
+
+class ExternalSorter:
+    """Sort more lines than fit in memory.
+
+    Lines are buffered until `buffer_size` of them have been added, then the
+    buffer is sorted and spilled to a temporary file as a run. Iterating the
+    sorter k-way merges the runs with whatever is still buffered. The sort is
+    stable: lines with equal keys come out in the order they were added.
+    """
+
+    def __init__(self, key, buffer_size=200000, tmp_dir=None):
+        self.key = key
+        self.buffer_size = buffer_size
+        self.tmp_dir = tmp_dir
+        self.count = 0
+        self._buffer = []
+        self._runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, line):
+        self._buffer.append(line)
+        self.count += 1
+        if len(self._buffer) >= self.buffer_size:
+            self._spill()
+
+    def _spill(self):
+        run = tempfile.TemporaryFile('w+', dir=self.tmp_dir)
+        self._buffer.sort(key=self.key)
+        run.writelines(self._buffer)
+        run.seek(0)
+        self._runs.append(run)
+        self._buffer = []
+
+    def __iter__(self):
+        self._buffer.sort(key=self.key)
+        return heapq.merge(*self._runs, iter(self._buffer), key=self.key)
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._buffer = []
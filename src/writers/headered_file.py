@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+
+
+class HeaderedFile:
+    """Text file whose header may only be known once the body has been written.
+
+    Most file headers list the species found in the data, so they cannot be
+    written until every record has been seen. When no header is given up front
+    the body is spooled to a temporary file next to the output and copied in
+    behind the header on close, keeping memory use flat either way.
+
+    ``suspend()`` closes the underlying file handle and the next ``resume()``
+    reopens it for appending, so many files can be written in turn without
+    all being open at once.
+    """
+
+    copy_buffer_size = 1024 * 1024
+
+    def __init__(self, filepath, header=None):
+        self.filepath = filepath
+        self.header = header
+        self.spooled = header is None
+        self.suspended = False
+        if self.spooled:
+            self.body = tempfile.NamedTemporaryFile('w+',
+                                                    dir=os.path.dirname(filepath) or '.',
+                                                    prefix='.' + os.path.basename(filepath) + '.',
+                                                    delete=False)
+        else:
+            self.body = open(filepath, 'w')
+            self.body.write(header)
+
+    def suspend(self):
+        if not self.suspended:
+            self.body.close()
+            self.suspended = True
+
+    def resume(self):
+        if self.suspended:
+            self.body = open(self.body.name, 'a+' if self.spooled else 'a')
+            self.suspended = False
+
+    def close(self, footer=''):
+        self.resume()
+        self.body.write(footer)
+        if not self.spooled:
+            self.body.close()
+            return
+
+        if self.header is None:
+            self.discard()
+            raise ValueError('No header set for ' + self.filepath)
+        self.body.seek(0)
+        with open(self.filepath, 'w') as output_file:
+            output_file.write(self.header)
+            shutil.copyfileobj(self.body, output_file, self.copy_buffer_size)
+        self.discard()
+
+    def discard(self):
+        """Close and delete whatever has been written, spooled or not."""
+        self.body.close()
+        if os.path.exists(self.body.name):
+            os.remove(self.body.name)
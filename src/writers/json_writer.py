@@ -0,0 +1,56 @@
+import json
+
+from .headered_file import HeaderedFile
+
+
+class JsonFileWriter:
+    """Write a ``{"metadata": ..., "data": [...]}`` document one record at a time.
+
+    The output is byte-for-byte what ``json.dump`` gives for the same document,
+    but only one record is held in memory at a time. `metadata` can be passed
+    when opening the file or assigned any time before it is closed.
+    """
+
+    def __init__(self, filepath, metadata=None):
+        self.filepath = filepath
+        self.metadata = metadata
+        self.count = 0
+        self._file = HeaderedFile(filepath, None if metadata is None else self._prefix(metadata))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.discard()
+
+    @staticmethod
+    def _prefix(metadata):
+        return '{"metadata": ' + json.dumps(metadata) + ', "data": ['
+
+    def write(self, record):
+        if self.count:
+            self._file.body.write(', ')
+        self._file.body.write(json.dumps(record))
+        self.count += 1
+
+    def write_batch(self, records):
+        if not records:
+            return
+        if self.count:
+            self._file.body.write(', ')
+        self._file.body.write(', '.join(map(json.dumps, records)))
+        self.count += len(records)
+
+    def suspend(self):
+        self._file.suspend()
+
+    def resume(self):
+        self._file.resume()
+
+    def close(self):
+        if self._file.spooled and self.metadata is not None:
+            self._file.header = self._prefix(self.metadata)
+        self._file.close(footer=']}')
@@ -0,0 +1,52 @@
+def exit_all(sinks, exc_type, exc_value, traceback):
+    """Exit every sink, even if an earlier one raises, then re-raise the first error."""
+    error = None
+    for sink in sinks:
+        try:
+            sink.__exit__(exc_type, exc_value, traceback)
+        except BaseException as e:
+            if error is None:
+                error = e
+    if error is not None:
+        raise error
+
+
+class MultiSink:
+    """Hand each record to several format writers in a single pass.
+
+    Any object with ``write(record)`` and ``close()`` (plus ``write_batch(records)``
+    if batches are written) can be a sink, so adding
+    an output format means adding a writer rather than another loop over the
+    data. Records are shared between sinks and must not be modified by them.
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        exit_all(self.sinks, exc_type, exc_value, traceback)
+
+    def write(self, record):
+        for sink in self.sinks:
+            sink.write(record)
+
+    def write_batch(self, records):
+        for sink in self.sinks:
+            sink.write_batch(records)
+
+    def suspend(self):
+        for sink in self.sinks:
+            if hasattr(sink, 'suspend'):
+                sink.suspend()
+
+    def resume(self):
+        for sink in self.sinks:
+            if hasattr(sink, 'resume'):
+                sink.resume()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+from .multi_sink import exit_all
+
+
+class PartitionedSink:
+    """Route each record to the sink of its partition and to a combined sink.
+
+    `open_partition(key)` is called the first time a key is written to and
+    returns that partition's sink (typically a MultiSink of file writers),
+    so the per-taxon and combined files are written in the same pass over
+    the data without grouping the records in memory first.
+
+    At most `max_open` partitions keep their files open; writing to another
+    one suspends the least recently used partition, which is resumed the
+    next time one of its records comes along.
+    """
+
+    def __init__(self, open_partition, combined=None, max_open=None):
+        self.open_partition = open_partition
+        self.combined = combined
+        self.max_open = max_open
+        self.partitions = {}
+        self._open = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        exit_all(self._sinks(), exc_type, exc_value, traceback)
+
+    def _sinks(self):
+        sinks = list(self.partitions.values())
+        if self.combined is not None:
+            sinks.append(self.combined)
+        return sinks
+
+    def _activate(self, key):
+        sink = self.partitions.get(key)
+        if key in self._open:
+            self._open.move_to_end(key)
+            return sink
+        if self.max_open is not None and len(self._open) >= self.max_open:
+            (_, lru_sink) = self._open.popitem(last=False)
+            lru_sink.suspend()
+        if sink is None:
+            sink = self.partitions[key] = self.open_partition(key)
+        else:
+            sink.resume()
+        self._open[key] = sink
+        return sink
+
+    def write(self, key, record):
+        self._activate(key).write(record)
+        if self.combined is not None:
+            self.combined.write(record)
+
+    def close(self):
+        for sink in self._sinks():
+            sink.close()
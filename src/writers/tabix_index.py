@@ -0,0 +1,94 @@
+import struct
+
+from .bgzf_writer import BgzfWriter
+
+LINEAR_INDEX_SHIFT = 14
+
+# Pseudo-bin htslib uses to store per reference offsets and record counts.
+META_BIN = 37450
+
+PRESETS = {
+    # format, sequence column, begin column, end column, meta character, lines to skip
+    'vcf': (2, 1, 2, 0, ord('#'), 0),
+}
+
+
+def reg2bin(begin, end):
+    """UCSC/SAM binning scheme bin of the 0-based, half-open interval [begin, end)."""
+    end -= 1
+    if begin >> 14 == end >> 14:
+        return ((1 << 15) - 1) // 7 + (begin >> 14)
+    if begin >> 17 == end >> 17:
+        return ((1 << 12) - 1) // 7 + (begin >> 17)
+    if begin >> 20 == end >> 20:
+        return ((1 << 9) - 1) // 7 + (begin >> 20)
+    if begin >> 23 == end >> 23:
+        return ((1 << 6) - 1) // 7 + (begin >> 23)
+    if begin >> 26 == end >> 26:
+        return ((1 << 3) - 1) // 7 + (begin >> 26)
+    return 0
+
+
+class TabixIndex:
+    """Build a tabix (.tbi) index while a sorted BGZF file is being written.
+
+    Call `add` for each record, in file order, with its interval and the
+    positions returned by ``BgzfWriter.tell`` before and after writing it.
+    `write` resolves those positions to virtual offsets, so it must be called
+    after the data file has been closed.
+    """
+
+    def __init__(self, preset='vcf'):
+        self.preset = PRESETS[preset]
+        self.names = []
+        self._references = {}
+
+    def add(self, name, begin, end, start_position, end_position):
+        reference = self._references.get(name)
+        if reference is None:
+            reference = self._references[name] = {'bins': {}, 'linear': [], 'start': start_position, 'count': 0}
+            self.names.append(name)
+        reference['end'] = end_position
+        reference['count'] += 1
+
+        chunks = reference['bins'].setdefault(reg2bin(begin, end), [])
+        if chunks and chunks[-1][1] == start_position:
+            chunks[-1][1] = end_position
+        else:
+            chunks.append([start_position, end_position])
+
+        linear = reference['linear']
+        last_window = (end - 1) >> LINEAR_INDEX_SHIFT
+        if len(linear) <= last_window:
+            linear.extend([None] * (last_window + 1 - len(linear)))
+        for window in range(begin >> LINEAR_INDEX_SHIFT, last_window + 1):
+            if linear[window] is None:
+                linear[window] = start_position
+
+    def write(self, filepath, bgzf_file):
+        voffset = bgzf_file.virtual_offset
+        names = b''.join(name.encode() + b'\0' for name in self.names)
+        with BgzfWriter(filepath) as index_file:
+            output = bytearray(b'TBI\1')
+            output += struct.pack('<i6i', len(self.names), *self.preset)
+            output += struct.pack('<i', len(names)) + names
+            for name in self.names:
+                reference = self._references[name]
+                output += struct.pack('<i', len(reference['bins']) + 1)
+                for (bin_number, chunks) in reference['bins'].items():
+                    output += struct.pack('<Ii', bin_number, len(chunks))
+                    for (chunk_start, chunk_end) in chunks:
+                        output += struct.pack('<QQ', voffset(chunk_start), voffset(chunk_end))
+                output += struct.pack('<IiQQQQ', META_BIN, 2,
+                                      voffset(reference['start']), voffset(reference['end']),
+                                      reference['count'], 0)
+
+                offsets = []
+                previous = voffset(reference['start'])
+                for position in reference['linear']:
+                    if position is not None:
+                        previous = voffset(position)
+                    offsets.append(previous)
+                output += struct.pack('<i', len(offsets)) + struct.pack('<%dQ' % len(offsets), *offsets)
+            output += struct.pack('<Q', 0)
+            index_file.write(output)
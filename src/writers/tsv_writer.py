@@ -0,0 +1,75 @@
+import csv
+
+from .headered_file import HeaderedFile
+
+
+def join_list(separator, unique=False):
+    """Return a TSV formatter that joins list values with `separator`.
+
+    Values that are not lists are written unchanged.
+    """
+
+    def formatter(value):
+        if not isinstance(value, list):
+            return value
+        return separator.join(set(value) if unique else value)
+
+    return formatter
+
+
+class TsvFileWriter:
+    """Write a tab separated file (comment header, column names, rows) row by row.
+
+    `header` is the comment block from ``create_header``; like the JSON writer
+    it can be given on open or assigned any time before the file is closed.
+    `formatters` maps a field name to a callable applied to that column as the
+    row is written, so the same record can be handed to the JSON writer and
+    this one without copying it.
+    """
+
+    def __init__(self, filepath, fields, header=None, formatters=None):
+        self.filepath = filepath
+        self.fields = fields
+        self.header = header
+        self.count = 0
+        formatters = formatters or {}
+        self._columns = [(field, formatters.get(field)) for field in fields]
+        self._file = HeaderedFile(filepath, None if header is None else self._prefix(header))
+        self._writer = csv.writer(self._file.body, delimiter='\t', lineterminator="\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.discard()
+
+    def _prefix(self, header):
+        return header + '\t'.join(self.fields) + '\n'
+
+    def _row(self, record):
+        return [record.get(field) if formatter is None else formatter(record.get(field))
+                for (field, formatter) in self._columns]
+
+    def write(self, record):
+        self._writer.writerow(self._row(record))
+        self.count += 1
+
+    def write_batch(self, records):
+        self._writer.writerows(map(self._row, records))
+        self.count += len(records)
+
+    def suspend(self):
+        self._file.suspend()
+
+    def resume(self):
+        if self._file.suspended:
+            self._file.resume()
+            self._writer = csv.writer(self._file.body, delimiter='\t', lineterminator="\n")
+
+    def close(self):
+        if self._file.spooled and self.header is not None:
+            self._file.header = self._prefix(self.header)
+        self._file.close()
@@ -0,0 +1,75 @@
+import gzip
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from writers import BgzfWriter, TabixIndex  # noqa: E402
+
+pysam = pytest.importorskip('pysam')
+
+HEADER = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+
+
+def vcf_lines():
+    random.seed(7)
+    lines = []
+    for chromosome in ['1', '2', 'X']:
+        position = 0
+        for i in range(6000):
+            position += random.randint(0, 40)
+            reference = random.choice(['A', 'CG', 'TTTAAAC' * random.randint(1, 20)])
+            lines.append('\t'.join([chromosome, str(position + 1), 'ID:%s-%d' % (chromosome, i), reference, 'T', '.', '.',
+                                    'INFO=' + 'x' * random.randint(0, 80)]) + '\n')
+    return lines
+
+
+def write_vcf(filepath, lines, threads):
+    index = TabixIndex('vcf')
+    with BgzfWriter(filepath, threads=threads) as bgzf_file:
+        bgzf_file.write(HEADER)
+        for line in lines:
+            start_position = bgzf_file.tell()
+            bgzf_file.write(line)
+            (chromosome, position, _, reference) = line.split('\t', 4)[:4]
+            begin = int(position) - 1
+            index.add(chromosome, begin, begin + len(reference), start_position, bgzf_file.tell())
+    index.write(filepath + '.tbi', bgzf_file)
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_round_trip(tmp_path, threads):
+    lines = vcf_lines()
+    filepath = str(tmp_path / 'test.vcf.gz')
+    write_vcf(filepath, lines, threads)
+
+    with gzip.open(filepath, 'rt') as vcf_file:
+        assert vcf_file.read() == HEADER + ''.join(lines)
+
+    random.seed(threads)
+    with pysam.TabixFile(filepath) as tabix_file:
+        assert sorted(tabix_file.contigs) == ['1', '2', 'X']
+        assert [row + '\n' for row in tabix_file.fetch('2')] == [line for line in lines if line.startswith('2\t')]
+        for _ in range(200):
+            chromosome = random.choice(['1', '2', 'X'])
+            start = random.randint(0, 130000)
+            end = start + random.randint(1, 20000)
+            expected = []
+            for line in lines:
+                (line_chromosome, position, _, reference) = line.split('\t', 4)[:4]
+                begin = int(position) - 1
+                if line_chromosome == chromosome and begin < end and begin + len(reference) > start:
+                    expected.append(line)
+            assert [row + '\n' for row in tabix_file.fetch(chromosome, start, end)] == expected
+
+
+def test_empty_file(tmp_path):
+    filepath = str(tmp_path / 'empty.vcf.gz')
+    write_vcf(filepath, [], 2)
+
+    with gzip.open(filepath, 'rt') as vcf_file:
+        assert vcf_file.read() == HEADER
+    with pysam.TabixFile(filepath) as tabix_file:
+        assert list(tabix_file.contigs) == []
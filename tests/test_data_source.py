@@ -0,0 +1,129 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from data_source import DataSource, PeekableDataSource, QueryCache, TeeDataSource  # noqa: E402
+
+URI = 'bolt://localhost:7687'
+
+
+class RecordedDataSource(DataSource):
+    """DataSource returning fixed records instead of querying Neo4j, counting the queries run."""
+
+    def __init__(self, query, records):
+        self.uri = URI
+        self.query = query
+        self.records = records
+        self.runs = 0
+
+    def _run(self):
+        self.runs += 1
+        for record in self.records:
+            yield dict(record)
+
+
+def records(count):
+    return [{'id': 'ZFIN:%d' % i, 'score': i / 3} for i in range(count)]
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    query_cache = QueryCache(str(tmp_path / 'cache'), '3.0.0', 1024 * 1024)
+    monkeypatch.setattr(DataSource, 'cache', query_cache)
+    return query_cache
+
+
+def test_hit_after_complete_iteration(cache):
+    data_source = RecordedDataSource('MATCH (g:Gene) RETURN g', records(100))
+    assert list(data_source) == records(100)
+    assert list(data_source) == records(100)
+    assert data_source.runs == 1
+    assert len(cache.entries()) == 1
+    assert [name for name in os.listdir(cache.directory) if name.endswith('.tmp')] == []
+
+
+def test_no_entry_after_aborted_iteration(cache):
+    data_source = RecordedDataSource('MATCH (g:Gene) RETURN g', records(100))
+    iterator = iter(data_source)
+    assert [next(iterator) for _ in range(10)] == records(10)
+    iterator.close()
+    assert os.listdir(cache.directory) == []
+
+    assert list(data_source) == records(100)
+    assert data_source.runs == 2
+
+
+def test_entries_are_keyed_by_release_and_query(cache):
+    assert cache.path(URI, 'MATCH (a) RETURN a') != cache.path(URI, 'MATCH (b) RETURN b')
+    other_release = QueryCache(cache.directory, '4.0.0', cache.max_size)
+    assert cache.path(URI, 'MATCH (a) RETURN a') != other_release.path(URI, 'MATCH (a) RETURN a')
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    data_sources = [RecordedDataSource('MATCH (g:Gene) RETURN g LIMIT %d' % i, records(1000)) for i in range(4)]
+    for (age, data_source) in enumerate(data_sources[:3]):
+        list(data_source)
+        path = cache.path(URI, data_source.query)
+        os.utime(path, (1000000 + age, 1000000 + age))
+    sizes = dict((path, size) for (_, size, path) in cache.entries())
+    # A hit refreshes the oldest entry, leaving the second one least recently used
+    list(data_sources[0])
+    assert data_sources[0].runs == 1
+
+    cache.max_size = sum(sizes.values())
+    list(data_sources[3])
+    remaining = set(path for (_, _, path) in cache.entries())
+    assert remaining == set(cache.path(URI, data_source.query) for data_source in [data_sources[0], data_sources[2], data_sources[3]])
+    assert sum(size for (_, size, _) in cache.entries()) <= cache.max_size
+
+
+def test_clear(cache):
+    list(RecordedDataSource('MATCH (g:Gene) RETURN g', records(10)))
+    other_release = QueryCache(cache.directory, '4.0.0', cache.max_size)
+    records_iterator = other_release.write(other_release.path(URI, 'MATCH (g:Gene) RETURN g'), iter(records(10)))
+    assert list(records_iterator) == records(10)
+    assert len(cache.entries()) == 2
+
+    cache.clear(release='3.0.0')
+    assert [os.path.basename(path).split('-')[0] for (_, _, path) in cache.entries()] == ['4.0.0']
+    cache.clear()
+    assert cache.entries() == []
+
+
+@pytest.mark.parametrize('count', [0, 1, 5])
+def test_peek_then_iterate(count):
+    data_source = RecordedDataSource('MATCH (a:Allele) RETURN a', records(count))
+    peekable = PeekableDataSource(data_source)
+    assert bool(peekable) == (count > 0)
+    assert peekable.peek() == (records(count)[0] if count else None)
+    assert peekable.peek('empty') == (records(count)[0] if count else 'empty')
+    assert list(peekable) == records(count)
+    assert data_source.runs == 1
+
+
+def is_multiple_of_three(record):
+    return int(record['id'].split(':')[1]) % 3 == 0
+
+
+def test_tee_runs_query_once():
+    data_source = RecordedDataSource('MATCH (g:Gene) RETURN g', records(10))
+    tee = TeeDataSource(data_source, is_multiple_of_three)
+    assert list(tee) == records(10)
+    assert tee.matches == [record for record in records(10) if is_multiple_of_three(record)]
+    assert data_source.runs == 1
+
+
+@pytest.mark.parametrize('columns', [False, True])
+def test_tee_batches_run_query_once(cache, columns):
+    data_source = RecordedDataSource('MATCH (g:Gene) RETURN g', records(10))
+    tee = TeeDataSource(data_source, is_multiple_of_three)
+    batches = list(tee.batches(4, columns=columns))
+    if columns:
+        assert batches[0] == {'id': ['ZFIN:0', 'ZFIN:1', 'ZFIN:2', 'ZFIN:3'], 'score': [0, 1 / 3, 2 / 3, 1]}
+        batches = [[dict(zip(batch, values)) for values in zip(*batch.values())] for batch in batches]
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert [record for batch in batches for record in batch] == records(10)
+    assert tee.matches == [record for record in records(10) if is_multiple_of_three(record)]
+    assert data_source.runs == 1
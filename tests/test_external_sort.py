@@ -0,0 +1,38 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from writers import ExternalSorter  # noqa: E402
+
+
+def line_key(line):
+    return int(line.split('\t', 1)[0])
+
+
+def test_spill_and_merge(tmp_path):
+    random.seed(3)
+    lines = ['%d\t%d\n' % (random.randint(0, 50), sequence) for sequence in range(1000)]
+    tmp_dir = str(tmp_path)
+
+    with ExternalSorter(line_key, buffer_size=64, tmp_dir=tmp_dir) as sorter:
+        for line in lines:
+            sorter.add(line)
+        assert len(sorter._runs) == 1000 // 64
+        merged = list(sorter)
+        runs = list(sorter._runs)
+
+    assert sorter.count == 1000
+    # sorted() is stable, so lines with equal keys keep the order they were added in
+    assert merged == sorted(lines, key=line_key)
+    assert all(run.closed for run in runs)
+    assert os.listdir(tmp_dir) == []
+
+
+def test_without_spilling(tmp_path):
+    lines = ['%d\tx\n' % key for key in [5, 3, 5, 1]]
+    with ExternalSorter(line_key, buffer_size=10, tmp_dir=str(tmp_path)) as sorter:
+        for line in lines:
+            sorter.add(line)
+        assert list(sorter) == ['1\tx\n', '3\tx\n', '5\tx\n', '5\tx\n']
+        assert sorter._runs == []
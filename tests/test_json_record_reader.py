@@ -0,0 +1,47 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from validators.json_validator import JsonRecordReader  # noqa: E402
+
+DOCUMENTS = [
+    '{"data": [6.78e10, 1.5, 2e-3]}',
+    '{"metadata": {"genTime": "2020-01-01"}, "data": []}',
+    '{"data": [], "metadata": {"release": 3.0}}',
+    '{ "data" : [ ] }',
+    '{}',
+    '{"metadata": {"count": 12}}',
+    '{"data": [-0.5, 1E+5, 3.25E-10, 12345678901234567890, 0, -7, true, false, null]}',
+    '{"data": [{"score": 0.25, "pos": [1, 2.5e3]}, {"score": -1e-7}], "metadata": {"version": 1.5}}',
+    '{"data": ["a \\"quoted\\" word", "back\\\\slash", "tab\\tnew\\nline", "\\u00e9t\\u00e9 \\ud83d\\ude00", "]},"]}',
+    '{\n  "metadata": {"note": "\\\\\\"}"},\n  "data": [\n    {"id": "ZFIN:1", "AF": 0.125},\n    {"id": "ZFIN:2", "AF": 1e2}\n  ]\n}\n',
+]
+
+
+def read(text, chunk_size):
+    reader = JsonRecordReader(io.StringIO(text))
+    reader.chunk_size = chunk_size
+    records = list(reader.records())
+    return (records, reader.document)
+
+
+@pytest.mark.parametrize('text', DOCUMENTS)
+def test_records_at_every_chunk_size(text):
+    expected = json.loads(text)
+    expected_records = expected.get('data', [])
+    expected_document = dict(expected, data=[]) if 'data' in expected else expected
+    for chunk_size in range(1, len(text) + 2):
+        (records, document) = read(text, chunk_size)
+        assert records == expected_records, 'chunk_size %d' % chunk_size
+        assert document == expected_document, 'chunk_size %d' % chunk_size
+
+
+@pytest.mark.parametrize('text', ['{"data": [6.]}', '{"data": [1e]}', '{"data": [1, 2', '{"data": [tru]}', '{"data": [1 2]}'])
+def test_invalid_json(text):
+    for chunk_size in range(1, len(text) + 2):
+        with pytest.raises(ValueError):
+            read(text, chunk_size)
@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from writers import JsonFileWriter  # noqa: E402
+
+METADATA = {'databaseVersion': '3.0.0', 'genTime': '2020-01-01 00:00', 'species': {'NCBITaxon:7955': 'Danio rerio'}}
+
+RECORDS = [{'GeneID': 'ZFIN:1', 'Score': 0.5, 'Names': ['a', 'b'], 'Missing': None},
+           {'GeneID': 'ZFIN:2', 'Note': 'café "quoted" \\ tab\t', 'Nested': {'x': [1, 2.5e-10, True]}},
+           {}]
+
+
+def json_dump(filepath, metadata, records):
+    with open(filepath, 'w') as json_file:
+        json.dump({'metadata': metadata, 'data': records}, json_file)
+
+
+def read_bytes(filepath):
+    with open(filepath, 'rb') as json_file:
+        return json_file.read()
+
+
+@pytest.mark.parametrize('records', [RECORDS, RECORDS[:1], []])
+@pytest.mark.parametrize('deferred', [False, True])
+def test_matches_json_dump(tmp_path, records, deferred):
+    expected_filepath = str(tmp_path / 'expected.json')
+    json_dump(expected_filepath, METADATA, records)
+
+    filepath = str(tmp_path / 'streamed.json')
+    with JsonFileWriter(filepath, None if deferred else METADATA) as json_writer:
+        for record in records:
+            json_writer.write(record)
+        json_writer.metadata = METADATA
+
+    assert read_bytes(filepath) == read_bytes(expected_filepath)
+    # The spooled body of a deferred-header file is removed once it is copied in
+    assert sorted(os.listdir(str(tmp_path))) == ['expected.json', 'streamed.json']
+
+
+@pytest.mark.parametrize('deferred', [False, True])
+def test_batches_match_json_dump(tmp_path, deferred):
+    expected_filepath = str(tmp_path / 'expected.json')
+    json_dump(expected_filepath, METADATA, RECORDS * 3)
+
+    filepath = str(tmp_path / 'batched.json')
+    with JsonFileWriter(filepath, None if deferred else METADATA) as json_writer:
+        json_writer.write(RECORDS[0])
+        json_writer.write_batch(RECORDS[1:])
+        json_writer.write_batch([])
+        json_writer.write_batch(RECORDS * 2)
+        json_writer.metadata = METADATA
+
+    assert read_bytes(filepath) == read_bytes(expected_filepath)
@@ -0,0 +1,70 @@
+import os
+import sys
+from concurrent.futures import Future
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from manifest import Manifest  # noqa: E402
+
+ROWS = [{'GeneID': 'ZFIN:1', 'Date': '20200101'}, {'GeneID': 'ZFIN:2', 'Date': '20200102'}]
+
+
+@pytest.fixture
+def manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(Manifest, 'path', str(tmp_path / 'manifest.json'))
+    monkeypatch.setattr(Manifest, 'release', '3.0.0')
+    monkeypatch.setattr(Manifest, '_entries', None)
+    return Manifest
+
+
+def new_run(manifest, monkeypatch, release):
+    monkeypatch.setattr(Manifest, 'release', release)
+    monkeypatch.setattr(Manifest, '_entries', None)
+
+
+def fingerprint(manifest, rows):
+    fp = manifest.fingerprint()
+    for row in rows:
+        fp.write(row)
+    return fp
+
+
+def test_skips_unchanged_partition_in_same_release(manifest, monkeypatch):
+    assert not manifest.uploaded('DISEASE-ALLIANCE', 'NCBITaxon:7955', fingerprint(manifest, ROWS))
+    manifest.record_upload('DISEASE-ALLIANCE', 'NCBITaxon:7955', fingerprint(manifest, ROWS))
+
+    new_run(manifest, monkeypatch, '3.0.0')
+    assert manifest.uploaded('DISEASE-ALLIANCE', 'NCBITaxon:7955', fingerprint(manifest, ROWS))
+    assert not manifest.uploaded('DISEASE-ALLIANCE', 'NCBITaxon:7955', fingerprint(manifest, ROWS[:1]))
+    assert not manifest.uploaded('DISEASE-ALLIANCE', 'NCBITaxon:10090', fingerprint(manifest, ROWS))
+    assert not manifest.uploaded('EXPRESSION-ALLIANCE', 'NCBITaxon:7955', fingerprint(manifest, ROWS))
+
+
+def test_reuploads_after_release_bump(manifest, monkeypatch):
+    manifest.record_upload('DISEASE-ALLIANCE', 'NCBITaxon:7955', fingerprint(manifest, ROWS))
+
+    new_run(manifest, monkeypatch, '4.0.0')
+    assert not manifest.uploaded('DISEASE-ALLIANCE', 'NCBITaxon:7955', fingerprint(manifest, ROWS))
+    manifest.record_upload('DISEASE-ALLIANCE', 'NCBITaxon:7955', fingerprint(manifest, ROWS))
+
+    new_run(manifest, monkeypatch, '4.0.0')
+    assert manifest.uploaded('DISEASE-ALLIANCE', 'NCBITaxon:7955', fingerprint(manifest, ROWS))
+
+
+def test_recorded_only_when_every_upload_succeeds(manifest, monkeypatch):
+    uploads = [Future(), Future()]
+    manifest.record_upload('VARIANT-ALLELE', 'NCBITaxon7955', fingerprint(manifest, ROWS), uploads)
+    uploads[0].set_result(None)
+    uploads[1].set_exception(IOError('upload failed'))
+
+    new_run(manifest, monkeypatch, '3.0.0')
+    assert not manifest.uploaded('VARIANT-ALLELE', 'NCBITaxon7955', fingerprint(manifest, ROWS))
+
+    uploads = [Future(), Future()]
+    manifest.record_upload('VARIANT-ALLELE', 'NCBITaxon7955', fingerprint(manifest, ROWS), uploads)
+    for upload in uploads:
+        upload.set_result(None)
+
+    new_run(manifest, monkeypatch, '3.0.0')
+    assert manifest.uploaded('VARIANT-ALLELE', 'NCBITaxon7955', fingerprint(manifest, ROWS))
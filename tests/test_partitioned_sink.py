@@ -0,0 +1,119 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from writers import JsonFileWriter, TsvFileWriter, MultiSink, PartitionedSink, join_list  # noqa: E402
+
+FIELDS = ['Taxon', 'GeneID', 'Names']
+FORMATTERS = {'Names': join_list(',')}
+TAXA = ['NCBITaxon:7955', 'NCBITaxon:10090', 'NCBITaxon:6239']
+
+# Interleaved so that with max_open=1 nearly every record suspends one partition and resumes another
+RECORDS = [{'Taxon': TAXA[i % 3 if i < 12 else i % 2], 'GeneID': 'G:%d' % i, 'Names': ['n%d' % i, 'm']} for i in range(20)]
+
+
+def header(taxon_ids):
+    return {'species': sorted(taxon_ids)}
+
+
+def tsv_header(taxon_ids):
+    return '# ' + ','.join(sorted(taxon_ids)) + '\n'
+
+
+def write_partitioned(folder, records, max_open):
+    opened = []
+
+    def open_partition(taxon_id):
+        opened.append(taxon_id)
+        filepath = os.path.join(folder, taxon_id)
+        return MultiSink(JsonFileWriter(filepath + '.json', header([taxon_id])),
+                         TsvFileWriter(filepath + '.tsv', FIELDS, tsv_header([taxon_id]), formatters=FORMATTERS))
+
+    combined_json_writer = JsonFileWriter(os.path.join(folder, 'combined.json'))
+    combined_tsv_writer = TsvFileWriter(os.path.join(folder, 'combined.tsv'), FIELDS, formatters=FORMATTERS)
+    taxon_ids = set()
+    with PartitionedSink(open_partition, MultiSink(combined_json_writer, combined_tsv_writer), max_open=max_open) as sink:
+        for record in records:
+            taxon_ids.add(record['Taxon'])
+            sink.write(record['Taxon'], record)
+            assert max_open is None or len(sink._open) <= max_open
+        combined_json_writer.metadata = header(taxon_ids)
+        combined_tsv_writer.header = tsv_header(taxon_ids)
+    return opened
+
+
+def read_json(filepath):
+    with open(filepath) as json_file:
+        return json.load(json_file)
+
+
+def read_text(filepath):
+    with open(filepath) as text_file:
+        return text_file.read()
+
+
+def tsv_rows(records):
+    return ''.join('\t'.join([record['Taxon'], record['GeneID'], ','.join(record['Names'])]) + '\n' for record in records)
+
+
+@pytest.mark.parametrize('max_open', [1, 2, None])
+def test_interleaved_partitions(tmp_path, max_open):
+    folder = str(tmp_path)
+    opened = write_partitioned(folder, RECORDS, max_open)
+
+    # Partitions are opened once, however often they are suspended and resumed
+    assert opened == TAXA
+    assert sorted(os.listdir(folder)) == sorted(['combined.json', 'combined.tsv'] +
+                                                [taxon_id + extension for taxon_id in TAXA for extension in ['.json', '.tsv']])
+    for taxon_id in TAXA:
+        taxon_records = [record for record in RECORDS if record['Taxon'] == taxon_id]
+        filepath = os.path.join(folder, taxon_id)
+        assert read_json(filepath + '.json') == {'metadata': header([taxon_id]), 'data': taxon_records}
+        assert read_text(filepath + '.tsv') == tsv_header([taxon_id]) + '\t'.join(FIELDS) + '\n' + tsv_rows(taxon_records)
+    assert read_json(os.path.join(folder, 'combined.json')) == {'metadata': header(TAXA), 'data': RECORDS}
+    assert read_text(os.path.join(folder, 'combined.tsv')) == tsv_header(TAXA) + '\t'.join(FIELDS) + '\n' + tsv_rows(RECORDS)
+
+
+def test_error_discards_every_file(tmp_path):
+    records = RECORDS[:7] + [{'GeneID': 'G:bad'}]
+    with pytest.raises(KeyError):
+        write_partitioned(str(tmp_path), records, 1)
+    assert os.listdir(str(tmp_path)) == []
+
+
+class FailingSink:
+
+    def __init__(self):
+        self.exits = []
+
+    def write(self, record):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.exits.append(exc_type)
+        raise IOError('disk full')
+
+
+class RecordingSink(FailingSink):
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.exits.append(exc_type)
+
+
+@pytest.mark.parametrize('raised', [None, KeyError])
+def test_every_sink_exits_when_one_fails(raised):
+    sinks = {'a': RecordingSink(), 'b': FailingSink(), 'c': RecordingSink()}
+    combined = RecordingSink()
+    with pytest.raises(IOError) as error:
+        with PartitionedSink(sinks.get, combined) as sink:
+            for key in 'abc':
+                sink.write(key, {})
+            if raised is not None:
+                raise raised('Taxon')
+    # The error from the block itself stays attached to the one raised on exit
+    assert isinstance(error.value.__context__, raised or type(None))
+    for recorded_sink in list(sinks.values()) + [combined]:
+        assert recorded_sink.exits == [raised]
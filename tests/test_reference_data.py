@@ -0,0 +1,76 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from common import ReferenceData  # noqa: E402
+
+
+@pytest.fixture
+def reference_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(ReferenceData, 'snapshot_path', str(tmp_path / 'snapshot.json'))
+    monkeypatch.setattr(ReferenceData, 'release', '3.0.0')
+    ReferenceData.clear()
+    yield ReferenceData
+    ReferenceData.clear()
+
+
+def test_slow_load_does_not_block_other_datasets(reference_data):
+    assemblies_loaded = threading.Event()
+
+    def load_species():
+        # Only finishes if the assemblies can be loaded while species are still loading
+        assert assemblies_loaded.wait(timeout=10)
+        return [['NCBITaxon:7955', 'Danio rerio']]
+
+    def load_assemblies():
+        assemblies_loaded.set()
+        return {'GRCz11': 'NCBITaxon:7955'}
+
+    species = {}
+    species_thread = threading.Thread(target=lambda: species.update(value=reference_data.get('species', load_species)))
+    species_thread.start()
+    assert reference_data.get('assemblies', load_assemblies) == {'GRCz11': 'NCBITaxon:7955'}
+    species_thread.join(timeout=10)
+    assert species['value'] == [['NCBITaxon:7955', 'Danio rerio']]
+
+
+def test_dataset_loaded_once(reference_data):
+    calls = []
+
+    def load_species():
+        calls.append(1)
+        return [['NCBITaxon:7955', 'Danio rerio']]
+
+    threads = [threading.Thread(target=reference_data.get, args=('species', load_species)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+
+def test_snapshot_is_keyed_by_release(reference_data, monkeypatch):
+    calls = []
+
+    def load_species():
+        calls.append(reference_data.release)
+        return [['NCBITaxon:7955', 'Danio rerio ' + reference_data.release]]
+
+    assert reference_data.get('species', load_species) == [['NCBITaxon:7955', 'Danio rerio 3.0.0']]
+
+    # A later run of the same release reads the snapshot
+    reference_data.clear()
+    assert reference_data.get('species', load_species) == [['NCBITaxon:7955', 'Danio rerio 3.0.0']]
+    assert calls == ['3.0.0']
+
+    # A run of a new release ignores it and replaces it
+    reference_data.clear()
+    monkeypatch.setattr(ReferenceData, 'release', '4.0.0')
+    assert reference_data.get('species', load_species) == [['NCBITaxon:7955', 'Danio rerio 4.0.0']]
+    assert calls == ['3.0.0', '4.0.0']
+    reference_data.clear()
+    assert reference_data.get('species', load_species) == [['NCBITaxon:7955', 'Danio rerio 4.0.0']]
+    assert calls == ['3.0.0', '4.0.0']
@@ -0,0 +1,89 @@
+import gzip
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from validators import VcfValidator  # noqa: E402
+from validators.vcf_validator import EXAMPLE_CASES  # noqa: E402
+
+HEADER = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+
+
+def vcf_line(chromosome, position, variant_id, reference='A', alternative='T'):
+    return '\t'.join([chromosome, str(position), variant_id, reference, alternative, '.', '.', 'hgvs=x']) + '\n'
+
+
+def example_lines():
+    return [vcf_line(example['CHROM'], example['POS'], example['ID'], example['REF'], example['ALT'])
+            for example in EXAMPLE_CASES['GRCz11']]
+
+
+def valid_lines():
+    # Chromosomes sort as strings, as the VCF generator writes them
+    lines = example_lines() + [vcf_line('10', 1, 'ZFIN:1'), vcf_line('10', 1, 'ZFIN:2'), vcf_line('13', 7, 'ZFIN:3'),
+                               vcf_line('5', 3, 'ZFIN:4'), vcf_line('5', 72118556, 'ZFIN:5')]
+    return sorted(lines, key=lambda line: (line.split('\t')[0], int(line.split('\t')[1])))
+
+
+def write_vcf(tmp_path, lines, filename='GRCz11-3.0.0.vcf'):
+    filepath = str(tmp_path / filename)
+    if filename.endswith('.gz'):
+        with gzip.open(filepath, 'wt') as vcf_file:
+            vcf_file.write(HEADER + ''.join(lines))
+    else:
+        with open(filepath, 'w') as vcf_file:
+            vcf_file.write(HEADER + ''.join(lines))
+    return filepath
+
+
+def assert_invalid(filepath, caplog, message):
+    with caplog.at_level(logging.ERROR):
+        with pytest.raises(SystemExit) as exit_info:
+            VcfValidator(filepath).validate_vcf()
+    assert exit_info.value.code == -1
+    assert message in caplog.text
+
+
+@pytest.mark.parametrize('filename', ['GRCz11-3.0.0.vcf', 'GRCz11-3.0.0.vcf.gz'])
+def test_valid(tmp_path, filename):
+    VcfValidator(write_vcf(tmp_path, valid_lines(), filename)).validate_vcf()
+
+
+def test_assembly_without_examples(tmp_path):
+    VcfValidator(write_vcf(tmp_path, [vcf_line('2L', 5, 'FB:1')], 'R6-3.0.0.vcf.gz')).validate_vcf()
+
+
+@pytest.mark.parametrize('filename', ['GRCz11-3.0.0.vcf', 'GRCz11-3.0.0.vcf.gz'])
+def test_chromosomes_out_of_order(tmp_path, caplog, filename):
+    lines = valid_lines()
+    lines.append(vcf_line('1', 1, 'ZFIN:6'))
+    assert_invalid(write_vcf(tmp_path, lines, filename), caplog, 'Chromosomes not alphabetically sorted')
+
+
+def test_positions_out_of_order(tmp_path, caplog):
+    lines = valid_lines()
+    lines.append(vcf_line('5', 72118555, 'ZFIN:6'))
+    assert_invalid(write_vcf(tmp_path, lines), caplog, 'Positions are not sorted in correct order')
+
+
+@pytest.mark.parametrize('filename', ['GRCz11-3.0.0.vcf', 'GRCz11-3.0.0.vcf.gz'])
+def test_duplicate_ids(tmp_path, caplog, filename):
+    lines = valid_lines()
+    lines.append(vcf_line('5', 72118557, 'ZFIN:4'))
+    lines.append(vcf_line('5', 72118558, 'ZFIN:4'))
+    assert_invalid(write_vcf(tmp_path, lines, filename), caplog, '2 Duplicate enteries')
+    assert 'ZFIN:4' in caplog.text
+
+
+def test_missing_example(tmp_path, caplog):
+    lines = [line for line in valid_lines() if EXAMPLE_CASES['GRCz11'][1]['ID'] not in line]
+    assert_invalid(write_vcf(tmp_path, lines), caplog,
+                   'No matching VCF data found for example with id: ' + EXAMPLE_CASES['GRCz11'][1]['ID'])
+
+
+def test_mismatched_example(tmp_path, caplog):
+    lines = [line.replace('\tGCCGTT\t', '\tGCCGTA\t') for line in valid_lines()]
+    assert_invalid(write_vcf(tmp_path, lines), caplog, 'key mismatch: ALT')